@@ -0,0 +1,185 @@
+import math
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request cannot be admitted.
+
+    Attributes:
+        retry_after (int): Seconds the client should wait before retrying
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `burst` tokens, refilled at `rate`
+    tokens per second. Not thread-safe; RateLimiter serializes access.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost=1):
+        """
+        Takes cost tokens if available.
+
+        Returns:
+            float: 0 on success, otherwise the seconds until enough tokens are available
+        """
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost):
+        """
+        Takes cost tokens even if that leaves the bucket in debt, for work
+        that has already happened (e.g. bytes already received).
+
+        Returns:
+            float: Seconds until the debt is paid off, 0 if there is none
+        """
+        self._refill()
+        self.tokens -= cost
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """
+    One token bucket per client key. The least recently seen clients are
+    forgotten beyond max_clients, which only ever resets them to a full bucket.
+
+    Args:
+        rate (float): Requests per second each client may sustain
+        burst (int): Requests a client may make at once
+        max_clients (int): Number of buckets kept
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def hit(self, key, cost=1):
+        """
+        Records a request of cost units for key.
+
+        Raises:
+            Overloaded: If the client has exhausted its bucket
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(key)
+            if cost > self.burst:
+                # A batch larger than the burst could never be taken at once:
+                # admit it with a full bucket and owe the rest, so it still
+                # pays its full cost before the client's next request
+                wait = bucket.take(self.burst)
+                if not wait:
+                    bucket.consume(cost - self.burst)
+            else:
+                wait = bucket.take(cost)
+            if wait:
+                self.limited += 1
+                raise Overloaded(wait)
+
+    def stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'clients': len(self._buckets), 'limited': self.limited}
+
+
+class SlotPool:
+    """
+    Fixed number of slots for an expensive operation, shared by all clients.
+    Waiters are served by priority, then in arrival order.
+
+    Args:
+        size (int): Number of operations allowed at once
+        retry_after (int): Retry-After suggested when no slot frees up in time
+    """
+
+    def __init__(self, size, retry_after=5):
+        self.size = size
+        self.retry_after = retry_after
+        self._condition = threading.Condition()
+        # Heap of (priority, arrival) tickets of the waiting callers
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self, timeout=None, priority=0):
+        """
+        Holds one slot for the enclosed block.
+
+        Args:
+            timeout (float): Seconds to wait for a slot; None waits forever
+            priority (int): Lower values get a free slot first
+
+        Raises:
+            Overloaded: If no slot became free within timeout
+        """
+        ticket = (priority, next(self._arrivals))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            self.waiting += 1
+            acquired = True
+            while self.in_use >= self.size or self._waiters[0] != ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    acquired = False
+                    break
+                self._condition.wait(remaining)
+            self._waiters.remove(ticket)
+            heapq.heapify(self._waiters)
+            self.waiting -= 1
+            if acquired:
+                self.in_use += 1
+            else:
+                self.rejected += 1
+            # The head of the queue changed; let the next waiter check
+            self._condition.notify_all()
+        if not acquired:
+            raise Overloaded(self.retry_after)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_use -= 1
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {'size': self.size, 'in_use': self.in_use, 'waiting': self.waiting, 'rejected': self.rejected}
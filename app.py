@@ -2,19 +2,35 @@ import os
 import logging
 import uuid
 import json
-import datetime
-import re
-import zipfile
 import time
 import threading
 from functools import wraps
-import yt_dlp
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, session, redirect, url_for
 import shutil
-from PIL import Image
-from urllib.parse import urlparse
-import tempfile
 from werkzeug.exceptions import BadRequest
+from cache import MetadataCache, MediaCache
+from utils import canonicalize_url, get_canonical_id, VIDEO_ID_RE
+from formats import plan_formats, choose_plan
+from downloader import (build_ydl_opts, make_progress_hooks, fetch_video, download_playlist,
+                        open_passthrough, PassthroughUnsupported)
+from streaming import (stream_zip, tee_stream, call_after_send, sse_event, blocking_body,
+                       SSE_KEEPALIVE, SSE_KEEPALIVE_INTERVAL)
+from tokens import DownloadTokens
+from transcode import AudioTranscoder, AUDIO_FORMATS, NATIVE
+from metrics import registry as metrics_registry, stage_timer, observe_stage, BYTES_TOTAL
+from download_log import DownloadLog
+from storage import StorageJanitor, InsufficientStorage
+from jobs import (JobManager, JobQueueFull, ClientLimitExceeded,
+                  FINISHED, FAILED, CANCELLED, FINAL_STATES, PROGRESS_INTERVAL)
+from admission import RateLimiter, SlotPool, Overloaded
+from extractors import ExtractorPool
+from bandwidth import BandwidthScheduler, INTERACTIVE, BULK
+from state import open_state_store
+import startup
+from export_bundle import ExportBundle, BUNDLE_NAME
+from thumbnails import ThumbnailCache, ThumbnailNotFound, FORMATS as THUMBNAIL_FORMATS, MIMETYPES as THUMBNAIL_MIMETYPES
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -24,281 +40,1058 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "youtube_downloader_secret")
 
-# Create downloads and logs directories if they don't exist
-if not os.path.exists('downloads'):
-    os.makedirs('downloads')
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-# Define log file path
-LOG_FILE = 'logs/downloads.txt'
-
-# Validate YouTube URL
-def is_valid_youtube_url(url):
-    youtube_regex = (
-        r'(https?://)?(www\.)?'
-        r'(youtube|youtu|youtube-nocookie)\.(com|be)/'
-        r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})|'
-        r'(https?://)?(www\.)?'
-        r'(youtube|youtu|youtube-nocookie)\.(com|be)/'
-        r'(playlist\?list=)([^&=%\?]+)'
-    )
-    youtube_match = re.match(youtube_regex, url)
-    return bool(youtube_match)
+# Structured download log (JSONL), written by a background thread
+download_log = DownloadLog(
+    path='logs/downloads.jsonl',
+    index_path='logs/downloads_index.sqlite3',
+    max_bytes=int(os.environ.get('DOWNLOAD_LOG_MAX_BYTES', 50 * 1024 ** 2)),
+    rotate_interval=int(os.environ.get('DOWNLOAD_LOG_ROTATE_INTERVAL', 86400)),
+    fsync_interval=float(os.environ.get('DOWNLOAD_LOG_FSYNC_INTERVAL', 5)),
+)
+
+# Jobs, download tokens and the media cache index. The default keeps them in
+# this process; sqlite:///path shares them between processes (and hosts that
+# mount the same volume for downloads/ and cache/), so no sticky sessions are needed
+state_store = open_state_store(os.environ.get('STATE_STORE', 'memory://'))
+
+# Background download workers; /download only enqueues and returns a job ID
+job_manager = JobManager(
+    workers=int(os.environ.get('DOWNLOAD_WORKERS', 2)),
+    max_queue=int(os.environ.get('DOWNLOAD_QUEUE_SIZE', 32)),
+    result_ttl=int(os.environ.get('JOB_RESULT_TTL', 3600)),
+    store=state_store,
+)
+
+# Admission control: per-client request rates in front of the expensive
+# endpoints, global slots for yt-dlp work and per-client job caps
+info_rate_limiter = RateLimiter(
+    rate=float(os.environ.get('INFO_RATE', 2)),
+    burst=int(os.environ.get('INFO_BURST', 10)),
+)
+download_rate_limiter = RateLimiter(
+    rate=float(os.environ.get('DOWNLOAD_RATE', 0.2)),
+    burst=int(os.environ.get('DOWNLOAD_BURST', 5)),
+)
+extract_slots = SlotPool(int(os.environ.get('EXTRACT_SLOTS', 8)))
+download_slots = SlotPool(int(os.environ.get('DOWNLOAD_SLOTS', 6)))
+EXTRACT_SLOT_TIMEOUT = float(os.environ.get('EXTRACT_SLOT_TIMEOUT', 5))
+MAX_JOBS_PER_IP = int(os.environ.get('MAX_JOBS_PER_IP', 4))
+MAX_JOBS_PER_SESSION = int(os.environ.get('MAX_JOBS_PER_SESSION', 2))
+
+# Reusable YoutubeDL instances for info extraction, one per concurrent extraction
+extractor_pool = ExtractorPool(
+    size=int(os.environ.get('EXTRACTOR_POOL_SIZE', os.environ.get('EXTRACT_SLOTS', 8))),
+    max_uses=int(os.environ.get('EXTRACTOR_MAX_USES', 50)),
+)
+
+# Download budget of the whole server in bytes/s (0 = unlimited), shared by
+# weight between interactive single videos and bulk playlists, and fragments
+# fetched at once. Each of the WEB_WORKERS processes enforces an equal part.
+bandwidth_scheduler = BandwidthScheduler(
+    rate=int(os.environ.get('DOWNLOAD_BANDWIDTH', 0)) // max(1, int(os.environ.get('WEB_WORKERS', 1))),
+    fragments={
+        INTERACTIVE: int(os.environ.get('FRAGMENT_CONCURRENCY', 4)),
+        BULK: int(os.environ.get('BULK_FRAGMENT_CONCURRENCY', 2)),
+    },
+)
+
+# Extracted video/playlist info keyed by canonical ID
+metadata_cache = MetadataCache(
+    max_entries=int(os.environ.get('METADATA_CACHE_SIZE', 1024)),
+    ttl=int(os.environ.get('METADATA_CACHE_TTL', 3600)),
+)
+
+# Finished downloads keyed by (video ID, format, postprocessors); hits skip yt-dlp
+media_cache = MediaCache(
+    root=os.environ.get('MEDIA_CACHE_DIR', 'cache/media'),
+    max_bytes=int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 10 * 1024 ** 3)),
+    store=state_store,
+    pinned=lambda: download_tokens.pinned_digests(),
+)
+
+# Resized thumbnails, fetched from upstream once per video
+thumbnail_cache = ThumbnailCache(
+    root=os.environ.get('THUMBNAIL_CACHE_DIR', 'cache/thumbs'),
+    max_bytes=int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 ** 2)),
+    memory_entries=int(os.environ.get('THUMBNAIL_MEMORY_ENTRIES', 512)),
+)
+THUMBNAIL_MAX_AGE = int(os.environ.get('THUMBNAIL_MAX_AGE', 7 * 86400))
+
+# Cloudflare deployment ZIP, rebuilt only when the application files change
+export_bundle = ExportBundle(app.root_path)
+
+# Audio conversion runs as ffmpeg processes, at most one per core by default
+audio_transcoder = AudioTranscoder(
+    workers=int(os.environ.get('TRANSCODE_WORKERS', 0)) or None,
+    quality=os.environ.get('AUDIO_QUALITY', '192'),
+)
+
+# Signed links to result files; files are removed once their tokens expire
+download_tokens = DownloadTokens(
+    app.secret_key,
+    ttl=int(os.environ.get('DOWNLOAD_TOKEN_TTL', 3600)),
+    media_cache=media_cache,
+    store=state_store,
+)
+
+# Top-level entries of downloads/ that must survive a janitor sweep
+def download_in_use(path):
+    job = job_manager.get(os.path.basename(path))
+    if job and job.status not in FINAL_STATES:
+        return True
+    path = os.path.abspath(path)
+    return any(ref == path or ref.startswith(path + os.sep)
+               for ref in download_tokens.referenced_paths())
+
+# One background janitor instead of per-request cleanup threads
+storage_janitor = StorageJanitor(
+    root='downloads',
+    quota_bytes=int(os.environ.get('DOWNLOADS_QUOTA_BYTES', 20 * 1024 ** 3)),
+    min_free_bytes=int(os.environ.get('MIN_FREE_BYTES', 1024 ** 3)),
+    ttls={
+        'cloudflare_export_': 300,  # Left behind by versions that built exports on disk
+        'stream-': 6 * 3600,
+    },
+    default_ttl=download_tokens.ttl + 600,
+    orphan_age=int(os.environ.get('ORPHAN_AGE', 600)),
+    interval=int(os.environ.get('JANITOR_INTERVAL', 60)),
+    in_use=download_in_use,
+)
+storage_janitor.add_callback(download_tokens.sweep)
+
+# Nothing above touches the disk or starts threads; that happens once, in
+# start_services(), so importing the app stays cheap for cold starts
+_services_lock = threading.Lock()
+_services_started = False
+
+def start_services():
+    """Creates the working directories, loads the caches and starts the background threads."""
+    global _services_started
+    if _services_started:
+        return
+    with _services_lock:
+        if _services_started:
+            return
+        with startup.report.phase('start_services'):
+            os.makedirs('downloads', exist_ok=True)
+            media_cache.open()
+            thumbnail_cache.open()
+            download_log.start()
+            storage_janitor.start()
+        _services_started = True
+
+# Heavy imports and the first extractor are otherwise set up on first use
+def prewarm():
+    """Loads yt-dlp and Pillow and creates one pooled extractor ahead of the first request."""
+    with startup.report.phase('prewarm'):
+        extractor_pool.warm(1)
+        from PIL import Image
+        Image.init()
+
+def start_prewarm():
+    threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
+
+PREWARM = os.environ.get('PREWARM', '1') != '0'
+
+# Point-in-time values exported on /metrics
+metrics_registry.gauge('ytdl_queue_depth', 'Download jobs waiting for a worker', job_manager.queue_depth)
+metrics_registry.gauge('ytdl_active_downloads', 'Download jobs currently running', job_manager.active_count)
+metrics_registry.gauge('ytdl_metadata_cache_hit_ratio', 'Metadata cache hit ratio',
+                       lambda: metadata_cache.stats()['hit_ratio'])
+metrics_registry.gauge('ytdl_media_cache_hit_ratio', 'Media cache hit ratio',
+                       lambda: media_cache.stats()['hit_ratio'])
+metrics_registry.gauge('ytdl_media_cache_bytes', 'Bytes stored in the media cache', lambda: media_cache.total_bytes)
+metrics_registry.gauge('ytdl_storage_free_bytes', 'Free disk space for downloads', storage_janitor.free_bytes)
+metrics_registry.gauge('ytdl_storage_reclaimed_bytes', 'Bytes reclaimed by the storage janitor',
+                       lambda: storage_janitor.reclaimed_bytes)
+metrics_registry.gauge('ytdl_download_tokens', 'Live download tokens', download_tokens.active_count)
+metrics_registry.gauge('ytdl_extract_slots_in_use', 'Info extractions running', lambda: extract_slots.in_use)
+metrics_registry.gauge('ytdl_download_slots_in_use', 'yt-dlp downloads running', lambda: download_slots.in_use)
+metrics_registry.gauge('ytdl_download_slots_waiting', 'yt-dlp downloads waiting for a slot',
+                       lambda: download_slots.waiting)
+metrics_registry.gauge('ytdl_extractors_idle', 'Pooled YoutubeDL instances ready for reuse',
+                       lambda: extractor_pool.stats()['idle'])
+metrics_registry.gauge('ytdl_bandwidth_jobs_active', 'Jobs transferring data under the bandwidth budget',
+                       lambda: sum(bandwidth_scheduler.stats()['active'].values()))
+metrics_registry.gauge('ytdl_transcodes_pending', 'Audio conversions queued or running',
+                       lambda: audio_transcoder.pending)
+
+# Whether /stream keeps a copy of relayed media in the media cache
+STREAM_WRITE_THROUGH = os.environ.get('STREAM_WRITE_THROUGH', '1') != '0'
+
+# Seconds /stream waits for a download slot before answering 503
+STREAM_SLOT_TIMEOUT = float(os.environ.get('STREAM_SLOT_TIMEOUT', 5))
+
+# Assign a trace ID to every request, not only those sending X-Trace-Id
+TRACE_ALL_REQUESTS = os.environ.get('TRACE_ALL_REQUESTS', '0') == '1'
+
+# Batch metadata requests: URL limit and shared extraction pool
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 500))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('BATCH_WORKERS', 8)),
+    thread_name_prefix='batch-info',
+)
+
+# Number of playlist entries listed per page (preview and /playlist_entries)
+PLAYLIST_PAGE_SIZE = int(os.environ.get('PLAYLIST_PAGE_SIZE', 50))
+
+# Number of playlist entries downloaded concurrently within one job
+PLAYLIST_PARALLELISM = int(os.environ.get('PLAYLIST_PARALLELISM', 3))
 
 # Extract video info using yt-dlp
 def get_video_info(url):
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'skip_download': True,
-        'writeinfojson': True,
-        'noplaylist': False,  # Allow playlists
+    try:
+        with extractor_pool.extractor(playlist_items=f'1:{PLAYLIST_PAGE_SIZE}') as ydl:
+            info = ydl.extract_info(url, download=False)
+            
+            # Handle both single videos and playlists
+            if 'entries' in info:  # It's a playlist
+                is_playlist = True
+                playlist_title = info.get('title', 'Unknown Playlist')
+                entries = list(info['entries'] or [])
+                if entries:
+                    # Resolve only the first entry for the preview card
+                    first_video = entries[0]
+                    if first_video.get('_type') == 'url':
+                        first_video = ydl.extract_info(first_video['url'], download=False)
+                    video_count = info.get('playlist_count') or len(entries)
+                else:
+                    return None  # Empty playlist
+            else:  # It's a single video
+                is_playlist = False
+                first_video = info
+                playlist_title = None
+                video_count = 1
+            
+            # Parse duration
+            duration_secs = first_video.get('duration', 0)
+            if duration_secs:
+                mins, secs = divmod(duration_secs, 60)
+                hours, mins = divmod(mins, 60)
+                if hours:
+                    duration_str = f"{hours}:{mins:02d}:{secs:02d}"
+                else:
+                    duration_str = f"{mins}:{secs:02d}"
+            else:
+                duration_str = "Unknown"
+
+            # Format upload date
+            upload_date = first_video.get('upload_date', '')
+            if upload_date and len(upload_date) == 8:
+                upload_date = f"{upload_date[6:8]}.{upload_date[4:6]}.{upload_date[0:4]}"
+            
+            # The planner ranks the real formats of the (first) video; the
+            # fixed selectors remain as a fallback when it finds nothing
+            plans = plan_formats(first_video)
+            best_video_format = format_option(
+                choose_plan(plans, 'video', prefer_ext='mp4'), 'Höchste Qualität', is_playlist
+            ) or {
+                'id': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+                'note': 'Höchste Qualität',
+                'ext': 'mp4',
+                'type': 'video'
+            }
+            
+            # Beste Audio-Option (MP3)
+            best_audio_format = format_option(
+                choose_plan(plans, 'audio', prefer_ext='mp3'), 'Beste Audioqualität', is_playlist
+            ) or {
+                'id': 'bestaudio/best',
+                'note': 'Beste Audioqualität',
+                'ext': 'mp3',
+                'type': 'audio',
+                'audio_format': 'mp3'
+            }
+            
+            sorted_formats = [best_video_format]
+            sorted_audio = [best_audio_format]
+            
+            # Original audio stream, kept without re-encoding
+            native_audio_format = format_option(
+                choose_plan(plans, 'audio', no_transcode=True, prefer_ext='m4a'), 'Original-Audio', is_playlist
+            )
+            if native_audio_format:
+                sorted_audio.append(native_audio_format)
+            
+            # Progressive alternative that needs no ffmpeg merge
+            no_remux_format = format_option(
+                choose_plan(plans, 'video', no_remux=True, prefer_ext='mp4'), 'Ohne Zusammenführen', is_playlist
+            )
+            if no_remux_format and no_remux_format['id'] != best_video_format['id']:
+                sorted_formats.append(no_remux_format)
+            
+            result = {
+                'title': first_video.get('title', 'Unknown Title'),
+                'uploader': first_video.get('uploader', 'Unknown Uploader'),
+                'upload_date': upload_date,
+                'duration': duration_str,
+                'thumbnail': first_video.get('thumbnail'),
+                'thumbnail_url': thumbnail_url(first_video),
+                'is_playlist': is_playlist,
+                'playlist_title': playlist_title,
+                'video_count': video_count,
+                'formats': sorted_formats,  # Include all available formats
+                'audio_formats': sorted_audio,  # Include all available audio formats
+                'plans': plans
+            }
+            if is_playlist:
+                result['playlist_page_size'] = PLAYLIST_PAGE_SIZE
+                result['entries'] = [playlist_entry_summary(entry) for entry in entries]
+            return result
+    except Exception as e:
+        logger.error(f"Error extracting video info: {e}")
+        return None
+
+# Proxied, resized thumbnail for a video; None if the ID is unusable
+def thumbnail_url(video):
+    video_id = video.get('id') or ''
+    if not VIDEO_ID_RE.match(video_id):
+        return None
+    return f'/thumb/{video_id}'
+
+# Turn a planner result into a format option for the UI
+def format_option(plan, note, is_playlist=False):
+    if not plan:
+        return None
+    return {
+        # Format IDs differ between videos, so playlists use the generic selector
+        'id': plan['selector'] if is_playlist else plan['id'],
+        'note': note,
+        'ext': plan['ext'],
+        'type': plan['type'],
+        'height': plan['height'],
+        'fps': plan['fps'],
+        'filesize_approx': plan['filesize_approx'],
+        'merge': plan['merge'],
+        'transcode': plan['transcode'],
+        'audio_format': plan.get('audio_format'),
+    }
+
+# Reduce a flat playlist entry to what the UI needs
+def playlist_entry_summary(entry):
+    return {
+        'id': entry.get('id'),
+        'title': entry.get('title'),
+        'duration': entry.get('duration'),
+        'url': entry.get('url') or entry.get('webpage_url'),
     }
+
+# List one page of a playlist without resolving the individual videos
+def get_playlist_page(url, page, page_size=None):
+    page_size = page_size or PLAYLIST_PAGE_SIZE
+    start = (page - 1) * page_size + 1
+    try:
+        with extractor_pool.extractor(playlist_items=f'{start}:{start + page_size - 1}') as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        logger.error(f"Error extracting playlist page: {e}")
+        return None
     
-    with tempfile.TemporaryDirectory() as temp_dir:
-        ydl_opts['paths'] = {'home': temp_dir}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+    if 'entries' not in info:
+        return None
+    
+    entries = [entry for entry in info['entries'] or [] if entry]
+    return {
+        'playlist_title': info.get('title', 'Unknown Playlist'),
+        'video_count': info.get('playlist_count'),
+        'page': page,
+        'page_size': page_size,
+        'entries': [playlist_entry_summary(entry) for entry in entries],
+    }
+
+# Start background services on the first request
+@app.before_request
+def ensure_services():
+    # Covers WSGI servers and test clients that never run the ASGI lifespan
+    start_services()
+
+# Optional per-request trace ID, logged with every timed stage
+@app.before_request
+def assign_trace_id():
+    g.trace_id = request.headers.get('X-Trace-Id') or (uuid.uuid4().hex[:16] if TRACE_ALL_REQUESTS else None)
+
+@app.after_request
+def add_trace_header(response):
+    if g.get('trace_id'):
+        response.headers['X-Trace-Id'] = g.trace_id
+    return response
+
+# Client keys for admission control: the remote address and a per-session ID
+def client_keys():
+    if 'client_id' not in session:
+        session['client_id'] = uuid.uuid4().hex
+    return f"ip:{request.remote_addr}", f"session:{session['client_id']}"
+
+def overloaded_response(message, retry_after, status):
+    response = jsonify({'error': message})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status
+
+# Reject clients that exceed their request rate with 429
+def rate_limited(limiter, cost=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            ip_key, _ = client_keys()
             try:
-                info = ydl.extract_info(url, download=False)
-                
-                # Handle both single videos and playlists
-                if 'entries' in info:  # It's a playlist
-                    is_playlist = True
-                    playlist_title = info.get('title', 'Unknown Playlist')
-                    entries = info['entries']
-                    if entries:
-                        first_video = entries[0]
-                        video_count = len(entries)
-                    else:
-                        return None  # Empty playlist
-                else:  # It's a single video
-                    is_playlist = False
-                    first_video = info
-                    playlist_title = None
-                    video_count = 1
-                
-                # Parse duration
-                duration_secs = first_video.get('duration', 0)
-                if duration_secs:
-                    mins, secs = divmod(duration_secs, 60)
-                    hours, mins = divmod(mins, 60)
-                    if hours:
-                        duration_str = f"{hours}:{mins:02d}:{secs:02d}"
-                    else:
-                        duration_str = f"{mins}:{secs:02d}"
-                else:
-                    duration_str = "Unknown"
-
-                # Format upload date
-                upload_date = first_video.get('upload_date', '')
-                if upload_date and len(upload_date) == 8:
-                    upload_date = f"{upload_date[6:8]}.{upload_date[4:6]}.{upload_date[0:4]}"
-                
-                # Nur zwei Optionen zur Verfügung stellen: Beste Videoqualität (MP4) und Beste Audioqualität (MP3)
-                # Beste Video-Option (MP4)
-                best_video_format = {
-                    'id': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                    'note': 'Höchste Qualität',
-                    'ext': 'mp4',
-                    'type': 'video'
-                }
-                
-                # Beste Audio-Option (MP3)
-                best_audio_format = {
-                    'id': 'bestaudio/best',
-                    'note': 'Beste Audioqualität',
-                    'ext': 'mp3',
-                    'type': 'audio'
-                }
-                
-                # Erstelle einfache Arrays mit nur je einer Option
-                sorted_formats = [best_video_format]
-                sorted_audio = [best_audio_format]
-                
-                return {
-                    'title': first_video.get('title', 'Unknown Title'),
-                    'uploader': first_video.get('uploader', 'Unknown Uploader'),
-                    'upload_date': upload_date,
-                    'duration': duration_str,
-                    'thumbnail': first_video.get('thumbnail'),
-                    'is_playlist': is_playlist,
-                    'playlist_title': playlist_title,
-                    'video_count': video_count,
-                    'formats': sorted_formats,  # Include all available formats
-                    'audio_formats': sorted_audio  # Include all available audio formats
-                }
-            except Exception as e:
-                logger.error(f"Error extracting video info: {e}")
-                return None
-
-# Log download information
-def log_download(video_title, ip_address, user_agent):
-    with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        log_entry = f"[{timestamp}] Video: {video_title} | IP: {ip_address} | Agent: {user_agent}\n"
-        f.write(log_entry)
+                units = cost() if cost else 1
+                # Requests that cost nothing do not even need a bucket
+                if units:
+                    limiter.hit(ip_key, units)
+            except Overloaded as e:
+                return overloaded_response('Zu viele Anfragen, bitte später erneut versuchen', e.retry_after, 429)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# Cached, single-flight extraction for a canonicalized URL
+def load_video_info(canonical, trace_id=None):
+    def extract():
+        # Only misses take a slot; waiting too long fails with Overloaded (503)
+        with extract_slots.slot(timeout=EXTRACT_SLOT_TIMEOUT):
+            with stage_timer('info_extract', trace_id):
+                return get_video_info(canonical['url'])
+    return metadata_cache.get_or_load(canonical['key'], extract)
+
 @app.route('/get_video_info', methods=['POST'])
+@rate_limited(info_rate_limiter)
 def fetch_video_info():
     url = request.form.get('url', '')
     
     if not url:
         return jsonify({'error': 'URL wird benötigt'}), 400
     
-    if not is_valid_youtube_url(url):
+    canonical = canonicalize_url(url)
+    if not canonical:
         return jsonify({'error': 'Ungültige YouTube-URL'}), 400
     
-    video_info = get_video_info(url)
+    # Identical IDs share one cached (or in-flight) extraction
+    with stage_timer('info_total', g.trace_id):
+        video_info = load_video_info(canonical, g.trace_id)
     
     if not video_info:
         return jsonify({'error': 'Video-Informationen konnten nicht abgerufen werden'}), 400
     
     # Store the URL in the session for later use
-    session['video_url'] = url
+    session['video_url'] = canonical['url']
     
     return jsonify(video_info)
 
+# A batch costs one request per URL
+def batch_cost():
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls') or request.form.get('urls', '').split()
+    return len(urls) if isinstance(urls, list) else 1
+
+@app.route('/get_video_info/batch', methods=['POST'])
+@rate_limited(info_rate_limiter, cost=batch_cost)
+def fetch_video_info_batch():
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if urls is None:
+        urls = request.form.get('urls', '').split()
+    if not isinstance(urls, list) or not urls:
+        return jsonify({'error': 'URLs werden benötigt'}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'error': f'Höchstens {BATCH_MAX_URLS} URLs pro Anfrage'}), 400
+    
+    # De-duplicate by canonical ID; report unusable URLs right away
+    invalid = []
+    requested = {}
+    for url in urls:
+        canonical = canonicalize_url(url) if isinstance(url, str) else None
+        if not canonical:
+            invalid.append(url)
+            continue
+        entry = requested.setdefault(canonical['key'], {'canonical': canonical, 'urls': []})
+        entry['urls'].append(url)
+    
+    trace_id = g.trace_id
+    
+    def generate():
+        for url in invalid:
+            yield json.dumps({'urls': [url], 'error': 'Ungültige YouTube-URL'}) + '\n'
+        
+        futures = {
+            batch_executor.submit(load_video_info, entry['canonical'], trace_id): key
+            for key, entry in requested.items()
+        }
+        try:
+            # Stream each result as soon as it is resolved
+            for future in as_completed(futures):
+                key = futures[future]
+                line = {'id': key, 'urls': requested[key]['urls']}
+                try:
+                    info = future.result()
+                except Exception as e:
+                    info = None
+                    logger.error(f"Batch extraction failed for {key}: {e}")
+                if info:
+                    line['info'] = info
+                else:
+                    line['error'] = 'Video-Informationen konnten nicht abgerufen werden'
+                yield json.dumps(line) + '\n'
+        finally:
+            # Client went away: drop work that has not started yet
+            for future in futures:
+                future.cancel()
+    
+    response = Response(generate(), mimetype='application/x-ndjson', headers={
+        'X-Accel-Buffering': 'no',
+    })
+    return blocking_body(response, request.environ)
+
+# Run a download inside a job worker (no request context available here)
+def perform_download(job, url, format_id, download_type, is_playlist, client, audio_format=None):
+    observe_stage('download_queue_wait', job.started_at - job.created_at, job.trace_id)
+    
+    # Create a unique download directory
+    download_dir = os.path.join('downloads', job.id)
+    os.makedirs(download_dir, exist_ok=True)
+    
+    record = {
+        'job_id': job.id,
+        'url': url,
+        'video_id': get_canonical_id(url),
+        'format': format_id,
+        'type': download_type,
+        'audio_format': audio_format,
+        'client_ip': client['ip'],
+        'user_agent': client['user_agent'],
+        'queue_seconds': round(job.started_at - job.created_at, 3),
+    }
+    
+    # Cache entries this job uses stay pinned until their download tokens
+    # are issued; later publishes could evict them otherwise
+    pins = []
+    try:
+        try:
+            with bandwidth_scheduler.lease(job.id, BULK if is_playlist else INTERACTIVE) as lease:
+                if is_playlist:
+                    title, entries = download_playlist(
+                        job, url, download_dir, format_id, audio_format,
+                        parallelism=PLAYLIST_PARALLELISM, media_cache=media_cache, transcoder=audio_transcoder,
+                        slots=download_slots, lease=lease, pins=pins,
+                    )
+                else:
+                    ydl_opts = build_ydl_opts(download_dir, format_id, fragments=lease.fragments)
+                    hooks = make_progress_hooks(job, throttle=lease.throttle)
+                    ydl_opts['progress_hooks'], ydl_opts['postprocessor_hooks'] = [hooks[0]], [hooks[1]]
+                    canonical_id = get_canonical_id(url)
+                    video_id = canonical_id.split(':', 1)[1] if canonical_id and canonical_id.startswith('video:') else None
+                    video = fetch_video(job, url, video_id, ydl_opts, media_cache, audio_transcoder, audio_format,
+                                        download_slots, lease, pins)
+                    files = video['files']
+                    for path in files:
+                        job.add_output(path)
+                    title = video['title'] or 'Video'
+                    entries = [{
+                        'index': 1,
+                        'id': video['id'],
+                        'title': title,
+                        'status': 'finished' if files else 'failed',
+                        'files': files,
+                        'cached': video['cached'],
+                        'error': None,
+                    }]
+        except Exception as e:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            download_log.log(**record, status='cancelled' if job.cancelled else 'failed', error=str(e),
+                             download_seconds=round(time.time() - job.started_at, 3))
+            raise
+    
+        files = [path for entry in entries for path in entry['files']]
+        if not files:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            download_log.log(**record, title=title, status='failed', error='no files',
+                             download_seconds=round(time.time() - job.started_at, 3))
+            raise RuntimeError('Download fehlgeschlagen oder keine Dateien gefunden')
+    
+        # Everything may have moved into the media cache; drop the empty directory
+        if not any(filenames for _, _, filenames in os.walk(download_dir)):
+            shutil.rmtree(download_dir, ignore_errors=True)
+    
+        observe_stage('download_total', time.time() - job.started_at, job.trace_id)
+    
+        # Log the download
+        download_log.log(
+            **record,
+            title=title,
+            status='finished',
+            files=len(files),
+            bytes=sum(os.path.getsize(path) for path in files),
+            cached=all(entry.get('cached') for entry in entries if entry['files']),
+            download_seconds=round(time.time() - job.started_at, 3),
+        )
+    
+        # One signed, expiring token per file; the files live until they expire
+        tokens = {path: download_tokens.issue(path, os.path.basename(path)) for path in files}
+    
+        return {
+            'title': title,
+            'download_path': files[0],
+            'filename': os.path.basename(files[0]),
+            'token': tokens[files[0]],
+            'files': files,
+            'entries': [
+                dict(entry,
+                     files=[os.path.basename(path) for path in entry['files']],
+                     tokens=[tokens[path] for path in entry['files']])
+                for entry in entries
+            ],
+        }
+    finally:
+        for digest in pins:
+            media_cache.release(digest)
+
+@app.route('/playlist_entries')
+@rate_limited(info_rate_limiter)
+def playlist_entries():
+    url = request.args.get('url') or session.get('video_url')
+    if not url:
+        return jsonify({'error': 'URL wird benötigt'}), 400
+    
+    canonical = canonicalize_url(url)
+    if not canonical:
+        return jsonify({'error': 'Ungültige YouTube-URL'}), 400
+    
+    page = request.args.get('page', 1, type=int)
+    page_size = min(request.args.get('page_size', PLAYLIST_PAGE_SIZE, type=int), 200)
+    if page < 1 or page_size < 1:
+        return jsonify({'error': 'Ungültige Seitenangabe'}), 400
+    
+    def loader():
+        # Only misses take a slot; waiting too long fails with Overloaded (503)
+        with extract_slots.slot(timeout=EXTRACT_SLOT_TIMEOUT):
+            return get_playlist_page(canonical['url'], page, page_size)
+    playlist_page = metadata_cache.get_or_load(f"{canonical['key']}:page:{page}:{page_size}", loader)
+    
+    if not playlist_page:
+        return jsonify({'error': 'Playlist-Einträge konnten nicht abgerufen werden'}), 400
+    
+    return jsonify(playlist_page)
+
+# Read planner constraints (max_mb, no_remux, min_height) from request values
+def plan_constraints(values):
+    try:
+        # Present but malformed must not silently mean "no constraint"
+        max_mb = float(values['max_mb']) if values.get('max_mb') is not None else None
+        min_height = int(values['min_height']) if values.get('min_height') is not None else None
+    except ValueError:
+        raise BadRequest('Ungültige Formatvorgaben')
+    if (max_mb is not None and not 0 < max_mb < float('inf')) or (min_height is not None and min_height <= 0):
+        raise BadRequest('Ungültige Formatvorgaben')
+    return {
+        'max_bytes': int(max_mb * 1024 * 1024) if max_mb is not None else None,
+        'no_remux': values.get('no_remux', 'false').lower() in ('1', 'true', 'yes'),
+        'no_transcode': values.get('no_transcode', 'false').lower() in ('1', 'true', 'yes'),
+        'min_height': min_height,
+    }
+
+def has_plan_constraints(values):
+    return any(name in values for name in ('max_mb', 'no_remux', 'no_transcode', 'min_height'))
+
+# A download only extracts info when the planner has to pick its format
+def plan_cost():
+    return 0 if request.form.get('format') or not has_plan_constraints(request.form) else 1
+
+# Pick a plan from the cached format index of url
+def choose_plan_for(url, download_type, constraints):
+    canonical = canonicalize_url(url)
+    if not canonical:
+        return None
+    video_info = load_video_info(canonical, g.trace_id)
+    if not video_info:
+        return None
+    return choose_plan(video_info.get('plans', []), download_type, **constraints)
+
+@app.route('/formats/plan')
+@rate_limited(info_rate_limiter)
+def format_plan():
+    url = request.args.get('url') or session.get('video_url')
+    if not url:
+        return jsonify({'error': 'URL wird benötigt'}), 400
+    
+    download_type = request.args.get('type', 'video')
+    constraints = plan_constraints(request.args)
+    constraints['prefer_ext'] = request.args.get('ext')
+    plan = choose_plan_for(url, download_type, constraints)
+    if not plan:
+        return jsonify({'error': 'Kein Format erfüllt die gewählten Vorgaben'}), 404
+    
+    return jsonify({'plan': plan})
+
 @app.route('/download', methods=['POST'])
+@rate_limited(download_rate_limiter)
+@rate_limited(info_rate_limiter, cost=plan_cost)
 def download_video():
     url = session.get('video_url')
     if not url:
         return jsonify({'error': 'Keine Video-URL in der Sitzung gefunden'}), 400
     
+    download_type = request.form.get('type', 'video')
+    is_playlist = json.loads(request.form.get('is_playlist', 'false').lower())
+    
     format_id = request.form.get('format')
+    audio_format = request.form.get('audio_format')
+    if not format_id and has_plan_constraints(request.form):
+        # Let the planner pick e.g. the best format under max_mb
+        plan = choose_plan_for(url, download_type, plan_constraints(request.form))
+        if not plan:
+            return jsonify({'error': 'Kein Format erfüllt die gewählten Vorgaben'}), 400
+        format_id = plan['selector'] if is_playlist else plan['id']
+        audio_format = audio_format or plan.get('audio_format')
     if not format_id:
         return jsonify({'error': 'Kein Format ausgewählt'}), 400
     
-    download_type = request.form.get('type', 'video')
-    is_playlist = json.loads(request.form.get('is_playlist', 'false').lower())
-    
-    # Create a unique download directory
-    download_id = str(uuid.uuid4())
-    download_dir = os.path.join('downloads', download_id)
-    os.makedirs(download_dir, exist_ok=True)
+    if download_type == 'audio':
+        audio_format = audio_format or 'mp3'
+        if audio_format != NATIVE and audio_format not in AUDIO_FORMATS:
+            return jsonify({'error': 'Ungültiges Audioformat'}), 400
+    else:
+        audio_format = None
     
-    # Prepare download options
-    ydl_opts = {
-        'paths': {'home': download_dir},
-        'format': format_id,
-        'outtmpl': '%(title)s.%(ext)s',
-        'noplaylist': not is_playlist,
+    client = {
+        'ip': request.remote_addr,
+        'user_agent': request.headers.get('User-Agent', 'Unknown'),
     }
     
-    # Add audio-specific options
-    if download_type == 'audio':
-        ydl_opts.update({
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': '%(title)s.%(ext)s',
-        })
+    try:
+        storage_janitor.check_space()
+    except InsufficientStorage as e:
+        logger.warning(f"Refusing download: {e}")
+        response = jsonify({'error': 'Nicht genügend Speicherplatz auf dem Server, bitte später erneut versuchen'})
+        response.headers['Retry-After'] = str(storage_janitor.interval)
+        return response, 507
     
-    # Start download in a way that we can get progress updates
-    def download_hook(d):
-        if d['status'] == 'downloading':
-            progress = {
-                'downloaded_bytes': d.get('downloaded_bytes', 0),
-                'total_bytes': d.get('total_bytes', 0),
-                'total_bytes_estimate': d.get('total_bytes_estimate', 0),
-                'elapsed': d.get('elapsed', 0),
-                'eta': d.get('eta', 0),
-                'speed': d.get('speed', 0),
-                'filename': d.get('filename', ''),
-                'status': 'downloading',
-                'progress': d.get('_percent_str', '0%').strip()
-            }
-            # For now we just log the progress - in a real app, we might use websockets or polling
-            logger.debug(f"Download progress: {progress['progress']}")
-        
-        elif d['status'] == 'finished':
-            logger.debug("Download finished")
+    ip_key, session_key = client_keys()
+    try:
+        job = job_manager.submit(perform_download, url, format_id, download_type, is_playlist, client,
+                                 audio_format, trace_id=g.trace_id, owners=(ip_key, session_key),
+                                 owner_limits={ip_key: MAX_JOBS_PER_IP, session_key: MAX_JOBS_PER_SESSION})
+    except ClientLimitExceeded:
+        return overloaded_response('Zu viele gleichzeitige Downloads, bitte warten Sie, bis einer fertig ist', 10, 429)
+    except JobQueueFull:
+        return overloaded_response('Server ausgelastet, bitte später erneut versuchen', 30, 503)
     
-    ydl_opts['progress_hooks'] = [download_hook]
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id),
+        'zip_url': url_for('job_zip', job_id=job.id) if is_playlist else None,
+    }), 202
+
+@app.route('/stream')
+@rate_limited(download_rate_limiter)
+def stream_video():
+    url = session.get('video_url')
+    if not url:
+        return jsonify({'error': 'Keine Video-URL in der Sitzung gefunden'}), 400
     
+    format_id = request.args.get('format', 'best[ext=mp4]/best')
+    write_through = STREAM_WRITE_THROUGH and request.args.get('cache', '1') != '0'
+    
+    canonical_id = get_canonical_id(url)
+    if not canonical_id or not canonical_id.startswith('video:'):
+        return jsonify({'error': 'Direktes Streaming ist nur für einzelne Videos möglich'}), 400
+    digest = media_cache.make_key(canonical_id.split(':', 1)[1], format_id)
+    
+    # Already cached: serve the stored file (no postprocessors, same key as /download)
+    entry = media_cache.lookup(digest)
+    if entry:
+        media_cache.acquire(digest)
+        response = send_file(entry['files'][0], as_attachment=True,
+                             download_name=os.path.basename(entry['files'][0]))
+        return call_after_send(response, lambda: media_cache.release(digest))
+    
+    # Extraction and relay hold a download slot until the response is closed
+    slot = ExitStack()
+    slot.enter_context(download_slots.slot(timeout=STREAM_SLOT_TIMEOUT))
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            
-            # Get the downloaded file path
-            if 'entries' in info and is_playlist:
-                # It's a playlist
-                files = []
-                for entry in info['entries']:
-                    if entry:
-                        for file in os.listdir(download_dir):
-                            if file.endswith(('.mp4', '.mkv', '.webm', '.mp3')):
-                                files.append(os.path.join(download_dir, file))
-                download_file = files[0] if files else None
-                title = info.get('title', 'Playlist')
-            else:
-                # Single video
-                files = [os.path.join(download_dir, f) for f in os.listdir(download_dir) 
-                         if f.endswith(('.mp4', '.mkv', '.webm', '.mp3'))]
-                download_file = files[0] if files else None
-                title = info.get('title', 'Video')
-            
-            if not download_file:
-                return jsonify({'error': 'Download fehlgeschlagen oder keine Dateien gefunden'}), 500
-            
-            # Log the download
-            log_download(
-                title,
-                request.remote_addr,
-                request.headers.get('User-Agent', 'Unknown')
-            )
-            
-            # Generate a download link with the file name
-            filename = os.path.basename(download_file)
-            session['download_path'] = download_file
-            session['download_filename'] = filename
-            
-            return jsonify({
-                'success': True, 
-                'download_link': url_for('serve_download'),
-                'filename': filename
-            })
-            
+        passthrough = open_passthrough(url, format_id)
+    except PassthroughUnsupported:
+        slot.close()
+        return jsonify({'error': 'Dieses Format muss zusammengeführt oder konvertiert werden; bitte /download verwenden'}), 409
     except Exception as e:
-        logger.error(f"Download error: {e}")
-        return jsonify({'error': f'Download fehlgeschlagen: {str(e)}'}), 500
+        slot.close()
+        logger.error(f"Stream error: {e}")
+        return jsonify({'error': f'Stream fehlgeschlagen: {str(e)}'}), 502
+    
+    sink_path = None
+    if write_through:
+        stream_dir = os.path.join('downloads', f'stream-{uuid.uuid4().hex}')
+        os.makedirs(stream_dir, exist_ok=True)
+        sink_path = os.path.join(stream_dir, passthrough.filename)
+    
+    # Only called once a complete copy has been written to sink_path
+    def on_complete(path):
+        media_cache.publish(digest, [path], title=passthrough.info.get('title'))
+    
+    def cleanup():
+        slot.close()
+        if sink_path:
+            shutil.rmtree(os.path.dirname(sink_path), ignore_errors=True)
+    
+    response = Response(
+        tee_stream(passthrough, sink_path, passthrough.size, on_complete),
+        mimetype=passthrough.response.headers.get('Content-Type', 'application/octet-stream'),
+    )
+    if passthrough.size:
+        response.headers['Content-Length'] = str(passthrough.size)
+    response.headers.set('Content-Disposition', 'attachment', filename=passthrough.filename)
+    response.call_on_close(cleanup)
+    return blocking_body(response, request.environ)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Auftrag nicht gefunden'}), 404
+    
+    data = job.to_dict()
+    data['queue_depth'] = job_manager.queue_depth()
+    return jsonify(data)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Auftrag nicht gefunden'}), 404
+    
+    def generate():
+        version = 0
+        while True:
+            new_version, progress = job.wait_progress(version, timeout=SSE_KEEPALIVE_INTERVAL)
+            if job.done:
+                yield sse_event('done', job.to_dict())
+                return
+            if new_version == version:
+                # Keep idle connections (and proxies) alive
+                yield SSE_KEEPALIVE
+                continue
+            version = new_version
+            yield sse_event('progress', progress)
+            # Rate-limit each watcher independently of the publisher
+            time.sleep(PROGRESS_INTERVAL)
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    return blocking_body(response, request.environ)
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Auftrag nicht gefunden'}), 404
+    
+    if job.status == FAILED:
+        return jsonify({'error': f'Download fehlgeschlagen: {job.error}'}), 500
+    if job.status == CANCELLED:
+        return jsonify({'error': 'Download wurde abgebrochen'}), 410
+    if job.status != FINISHED:
+        return jsonify(job.to_dict()), 202
+    
+    entries = [
+        dict(entry, links=[url_for('serve_file', token=token) for token in entry['tokens']])
+        for entry in job.result['entries']
+    ]
+    
+    # Several files (playlists) are delivered as one streamed ZIP
+    if len(job.result['files']) > 1:
+        return jsonify({
+            'success': True,
+            'download_link': url_for('job_zip', job_id=job.id),
+            'filename': f"{job.result['title']}.zip",
+            'entries': entries,
+        })
+    
+    # Remember the latest token for the legacy /serve_download link
+    session['download_token'] = job.result['token']
+    
+    return jsonify({
+        'success': True,
+        'download_link': url_for('serve_file', token=job.result['token']),
+        'filename': job.result['filename'],
+        'expires_in': download_tokens.ttl,
+        'entries': entries,
+    })
+
+@app.route('/jobs/<job_id>/zip')
+def job_zip(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Auftrag nicht gefunden'}), 404
+    
+    if job.status == FAILED:
+        return jsonify({'error': f'Download fehlgeschlagen: {job.error}'}), 500
+    if job.status == CANCELLED:
+        return jsonify({'error': 'Download wurde abgebrochen'}), 410
+    
+    # Entries are added to the archive as soon as each one has finished,
+    # so this can be requested while the job is still running
+    pinned = []
+    
+    def files():
+        for path, name in job.iter_outputs():
+            # Keep cached entries from being evicted while they are sent
+            digest = media_cache.digest_for_path(path)
+            media_cache.acquire(digest)
+            pinned.append(digest)
+            yield path, name
+    
+    title = job.result['title'] if job.result else 'playlist'
+    
+    response = Response(stream_zip(files()), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=f'{title}.zip')
+    
+    # The files themselves are removed when their download tokens expire
+    def release_after_send():
+        for digest in pinned:
+            media_cache.release(digest)
+    
+    response.call_on_close(release_after_send)
+    return blocking_body(response, request.environ)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Auftrag nicht gefunden'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/files/<token>')
+def serve_file(token):
+    entry = download_tokens.resolve(token)
+    if not entry or not os.path.exists(entry['path']):
+        return jsonify({'error': 'Datei nicht gefunden oder Download-Link abgelaufen'}), 410
+    
+    # conditional=True answers Range, If-Range and If-None-Match against the
+    # file's ETag, so an interrupted transfer resumes with only the missing bytes
+    # Token entries hold absolute paths; send_file would resolve relative ones
+    # against the app root, not the working directory
+    response = send_file(entry['path'], as_attachment=True, download_name=entry['filename'],
+                         conditional=True, etag=True, max_age=0)
+    response.headers['Cache-Control'] = 'private, no-transform'
+    
+    started = time.monotonic()
+    sent_bytes = response.content_length or 0
+    trace_id = g.trace_id
+    
+    def after_send():
+        observe_stage('serve_send', time.monotonic() - started, trace_id)
+        BYTES_TOTAL.inc(sent_bytes, direction='served')
+    
+    return call_after_send(response, after_send)
 
 @app.route('/serve_download')
 def serve_download():
-    download_path = session.get('download_path')
-    filename = session.get('download_filename')
-    
-    if not download_path or not filename or not os.path.exists(download_path):
+    token = session.get('download_token')
+    if not token or not download_tokens.resolve(token):
         return "Datei nicht gefunden oder Download-Link abgelaufen", 404
+    return redirect(url_for('serve_file', token=token))
+
+@app.route('/thumb/<video_id>')
+@rate_limited(info_rate_limiter)
+def thumbnail(video_id):
+    if not VIDEO_ID_RE.match(video_id):
+        return jsonify({'error': 'Ungültige Video-ID'}), 400
     
-    def remove_after_send(download_dir):
-        # Clean up by removing the download directory after serving the file
-        parent_dir = os.path.dirname(download_path)
-        if os.path.exists(parent_dir) and parent_dir.startswith('downloads/'):
-            try:
-                shutil.rmtree(parent_dir)
-            except Exception as e:
-                logger.error(f"Error removing directory {parent_dir}: {e}")
+    width = thumbnail_cache.variant_width(max(1, request.args.get('w', 480, type=int)))
+    fmt = request.args.get('fmt')
+    if fmt not in THUMBNAIL_FORMATS:
+        fmt = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
     
-    response = send_file(download_path, as_attachment=True, download_name=filename)
+    # Prefer the thumbnail yt-dlp reported, when the video info is cached;
+    # nothing is loaded here, so this must not count as a hit or miss
+    info = metadata_cache.peek(f'video:{video_id}')
+    try:
+        data, etag = thumbnail_cache.get(video_id, width, fmt, source_url=info and info.get('thumbnail'))
+    except ThumbnailNotFound:
+        return jsonify({'error': 'Vorschaubild nicht gefunden'}), 404
     
-    # Schedule directory removal for after response is sent
-    # This is a hack since Flask doesn't have a post-send hook
-    response.call_on_close(lambda: remove_after_send(os.path.dirname(download_path)))
+    response = Response(data, mimetype=THUMBNAIL_MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    response.vary.add('Accept')
+    return response.make_conditional(request)
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats/downloads')
+def download_stats():
+    view = request.args.get('view', 'top_videos')
+    days = max(1, min(request.args.get('days', 7, type=int), 366))
     
-    return response
+    if view == 'top_videos':
+        limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+        return jsonify({'days': days, 'top_videos': download_log.top_videos(days, limit)})
+    if view == 'bytes_per_day':
+        return jsonify({'days': days, 'bytes_per_day': download_log.bytes_per_day(days)})
+    if view == 'log':
+        return jsonify(download_log.stats())
+    return jsonify({'error': 'Unbekannte Ansicht'}), 400
+
+@app.route('/stats/storage')
+def storage_stats():
+    return jsonify(storage_janitor.stats())
+
+@app.route('/stats/cache')
+def cache_stats():
+    return jsonify({
+        'metadata': metadata_cache.stats(),
+        'media': media_cache.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+    })
+
+@app.route('/stats/admission')
+def admission_stats():
+    return jsonify({
+        'info_rate': info_rate_limiter.stats(),
+        'download_rate': download_rate_limiter.stats(),
+        'extract_slots': extract_slots.stats(),
+        'download_slots': download_slots.stats(),
+        'queue_depth': job_manager.queue_depth(),
+        'max_jobs_per_ip': MAX_JOBS_PER_IP,
+        'max_jobs_per_session': MAX_JOBS_PER_SESSION,
+    })
+
+@app.route('/stats/extractors')
+def extractor_stats():
+    return jsonify(extractor_pool.stats())
+
+@app.route('/stats/bandwidth')
+def bandwidth_stats():
+    return jsonify(bandwidth_scheduler.stats())
+
+@app.route('/stats/startup')
+def startup_stats():
+    return jsonify(startup.report.as_dict())
+
+@app.route('/stats/transcode')
+def transcode_stats():
+    return jsonify(audio_transcoder.stats())
 
 # Error handlers
 @app.errorhandler(400)
 def bad_request(error):
     return jsonify({'error': str(error)}), 400
 
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    return overloaded_response('Server ausgelastet, bitte später erneut versuchen', error.retry_after, 503)
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Ressource nicht gefunden'}), 404
@@ -306,127 +1099,29 @@ def not_found(error):
 @app.route('/cloudflare_export')
 def cloudflare_export():
     """
-    Erstellt ein ZIP-Paket mit allen notwendigen Dateien für die Cloudflare-Bereitstellung.
+    Liefert das ZIP-Paket mit allen notwendigen Dateien für die Cloudflare-Bereitstellung.
+    Das Paket wird nur neu gebaut, wenn sich eine der enthaltenen Dateien geändert hat.
     """
-    # Erstelle ein temporäres Verzeichnis für das Export-Paket
-    export_id = str(uuid.uuid4())
-    export_dir = os.path.join('downloads', f'cloudflare_export_{export_id}')
-    os.makedirs(export_dir, exist_ok=True)
-    
     try:
-        # ZIP-Dateiname
-        zip_filename = os.path.join(export_dir, 'youtube_downloader_cloudflare.zip')
-        
-        # Dateien und Verzeichnisse, die in das ZIP-Paket aufgenommen werden sollen
-        files_to_include = []
-        
-        # Python-Dateien im Hauptverzeichnis
-        for file in os.listdir('.'):
-            if file.endswith('.py'):
-                files_to_include.append((file, file))
-        
-        # Templates-Verzeichnis
-        for file in os.listdir('templates'):
-            files_to_include.append((os.path.join('templates', file), os.path.join('templates', file)))
-        
-        # Static-Verzeichnis
-        for root, dirs, files in os.walk('static'):
-            for file in files:
-                source_path = os.path.join(root, file)
-                relative_path = os.path.relpath(source_path, '.')
-                files_to_include.append((source_path, relative_path))
-        
-        # Wichtige Konfigurationsdateien
-        for file in ['.replit', 'requirements.txt', 'pyproject.toml']:
-            if os.path.exists(file):
-                files_to_include.append((file, file))
-        
-        # Eine Beispiel-Umgebungsdatei für Cloudflare
-        with open(os.path.join(export_dir, '.env.example'), 'w') as f:
-            f.write("# Umgebungsvariablen für die Cloudflare-Bereitstellung\n")
-            f.write("SESSION_SECRET=ändere_mich_in_einen_sicheren_wert\n")
-        
-        files_to_include.append((os.path.join(export_dir, '.env.example'), '.env.example'))
-        
-        # Eine README-Datei mit Anweisungen
-        readme_content = """# YouTube Downloader für Cloudflare
-
-## Anleitung zur Bereitstellung
-
-1. Entpacken Sie dieses ZIP-Archiv in ein Verzeichnis
-2. Erstellen Sie eine Datei `.env` basierend auf `.env.example` und setzen Sie alle erforderlichen Umgebungsvariablen
-3. Stellen Sie die Anwendung auf Cloudflare Workers bereit:
-   ```
-   wrangler deploy
-   ```
-
-## Anforderungen
-
-- Python 3.9 oder höher
-- yt-dlp
-- Flask
-- ffmpeg (für Audio-Konvertierung)
-
-## Hinweise
-
-Diese Anwendung ist als Demonstration gedacht. Bitte beachten Sie die Urheberrechte und Nutzungsbedingungen von YouTube.
-"""
-        
-        with open(os.path.join(export_dir, 'README.md'), 'w') as f:
-            f.write(readme_content)
-        
-        files_to_include.append((os.path.join(export_dir, 'README.md'), 'README.md'))
-        
-        # Beispiel Cloudflare Workers-Konfiguration
-        wrangler_config = """name = "youtube-downloader"
-main = "main.py"
-compatibility_date = "2025-03-20"
-
-[vars]
-# Setzen Sie Umgebungsvariablen in der Datei .env oder in der Cloudflare-Konsole
-
-[env.production]
-workers_dev = true
-"""
-        
-        with open(os.path.join(export_dir, 'wrangler.toml'), 'w') as f:
-            f.write(wrangler_config)
-        
-        files_to_include.append((os.path.join(export_dir, 'wrangler.toml'), 'wrangler.toml'))
-        
-        # Erstelle das ZIP-Archiv
-        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for source_path, zip_path in files_to_include:
-                if os.path.exists(source_path):
-                    zipf.write(source_path, zip_path)
-        
-        # Sende die ZIP-Datei
-        return send_file(
-            zip_filename,
-            as_attachment=True,
-            download_name='youtube_downloader_cloudflare.zip'
-        )
-    
+        data, etag = export_bundle.get()
     except Exception as e:
         logger.error(f"Fehler beim Erstellen des Cloudflare-Exports: {e}")
         return jsonify({'error': f'Export fehlgeschlagen: {str(e)}'}), 500
-    finally:
-        # Bereinige das temporäre Verzeichnis nach einer kurzen Verzögerung
-        def delayed_cleanup():
-            try:
-                time.sleep(10)  # Kleine Verzögerung, um sicherzustellen, dass die Datei gesendet wurde
-                if os.path.exists(export_dir):
-                    shutil.rmtree(export_dir)
-            except Exception as e:
-                logger.error(f"Fehler beim Bereinigen des Export-Verzeichnisses: {e}")
-        
-        # In einer Produktionsumgebung würde man hier einen Background-Worker verwenden
-        import threading
-        threading.Thread(target=delayed_cleanup).start()
+    
+    response = Response(data, mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={BUNDLE_NAME}'
+    response.set_etag(etag)
+    # Clients may keep the bundle but must revalidate; unchanged bundles cost a 304
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.errorhandler(500)
 def server_error(error):
     return jsonify({'error': 'Interner Serverfehler'}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only; use main.py for the production (ASGI) server
+    start_services()
+    if PREWARM:
+        start_prewarm()
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG', '0') == '1')
@@ -0,0 +1,293 @@
+"""
+ASGI entry point: uvicorn asgi:application (or python main.py).
+
+Connections live on the event loop; threads are only borrowed for actual
+work. Flask views run on a bounded thread pool, and response bodies are
+pulled from them one chunk at a time, so a slow client downloading a file
+holds a socket but no thread while its buffer drains. Bodies that may block
+between chunks (marked with streaming.blocking_body()) get a pool of their
+own, so they never hold up views. Job event streams are served natively by
+coroutines because they are idle most of the time.
+"""
+import os
+import io
+import re
+import json
+import sys
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.wsgi import FileWrapper
+
+import startup
+
+with startup.report.phase('import_app'):
+    from app import app, job_manager, start_services, start_prewarm, PREWARM
+from jobs import PROGRESS_INTERVAL
+from streaming import sse_event, SSE_KEEPALIVE, SSE_KEEPALIVE_INTERVAL, BLOCKING_BODY
+
+logger = logging.getLogger(__name__)
+
+# Threads that run Flask views and produce response chunks
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 16))
+
+# Threads for blocking bodies (ZIPs of running jobs, batches, /stream);
+# one per response, further ones are rejected with 503
+ASGI_STREAM_THREADS = int(os.environ.get('ASGI_STREAM_THREADS', 32))
+
+# Retry-After sent when all stream threads are busy
+STREAM_RETRY_AFTER = 5
+
+# Block size for files sent through send_file; larger blocks mean fewer thread hops
+FILE_BLOCK_SIZE = 256 * 1024
+
+# How often native event streams look for new job progress
+EVENT_POLL_INTERVAL = 0.25
+
+JOB_EVENTS_RE = re.compile(r'^/jobs/([0-9a-f]+)/events$')
+
+_END = object()
+
+
+class WsgiBridge:
+    """
+    Serves a WSGI application over ASGI with a fixed thread budget.
+
+    Args:
+        wsgi_app (callable): The WSGI application
+        threads (int): Maximum threads used for views and body chunks
+        stream_threads (int): Maximum concurrent blocking bodies
+    """
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, stream_threads=ASGI_STREAM_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.stream_executor = ThreadPoolExecutor(max_workers=stream_threads, thread_name_prefix='asgi-stream')
+        self.stream_threads = stream_threads
+        # Only touched on the event loop
+        self.streams = 0
+
+    async def __call__(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, bytes(body))
+        result = None
+        executor = self.executor
+        try:
+            try:
+                response, result, iterator, chunk = await loop.run_in_executor(
+                    self.executor, self._start, environ
+                )
+            except Exception as e:
+                logger.error(f"Error handling {scope['path']}: {e}")
+                await _send_error(send)
+                return
+
+            if environ.get(BLOCKING_BODY):
+                if self.streams >= self.stream_threads:
+                    await _send_error(send, 503, 'Server ausgelastet, bitte später erneut versuchen',
+                                      [(b'retry-after', str(STREAM_RETRY_AFTER).encode('latin-1'))])
+                    return
+                # At most one chunk is pulled at a time, so this never queues
+                self.streams += 1
+                executor = self.stream_executor
+
+            await send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': response['headers'],
+            })
+            while chunk is not _END and not disconnected.is_set():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(executor, next, iterator, _END)
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            watcher.cancel()
+            if executor is self.stream_executor:
+                self.streams -= 1
+            if result is not None and hasattr(result, 'close'):
+                # Runs close callbacks (cache pins, temp dirs) off the event loop
+                await loop.run_in_executor(self.executor, result.close)
+
+    def _start(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+            return _unsupported_write
+
+        result = self.wsgi_app(environ, start_response)
+        iterator = iter(result)
+        if environ.get(BLOCKING_BODY) and response:
+            # Even the first chunk may block; it is pulled on the stream pool
+            return response, result, iterator, b''
+        # Generators may only call start_response on their first iteration
+        chunk = next(iterator, _END)
+        return response, result, iterator, chunk
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': lambda file, block_size=8192: FileWrapper(file, max(block_size, FILE_BLOCK_SIZE)),
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+
+async def _watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+def _unsupported_write(data):
+    raise NotImplementedError('The WSGI write() callable is not supported')
+
+
+async def _send_error(send, status=500, message='Interner Serverfehler', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps({'error': message}).encode('utf-8')})
+
+
+async def job_events(job, receive, send):
+    """Streams a job's progress as server-sent events without holding a thread."""
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    try:
+        version = 0
+        last_sent = time.monotonic()
+        while not disconnected.is_set():
+            done, new_version, data = await _off_loop(_job_state, job)
+            if done:
+                await _send_event(send, sse_event('done', data), more=False)
+                return
+            if new_version != version:
+                version = new_version
+                await _send_event(send, sse_event('progress', data))
+                last_sent = time.monotonic()
+                # Rate-limit each watcher independently of the publisher
+                await asyncio.sleep(PROGRESS_INTERVAL)
+                continue
+            if time.monotonic() - last_sent >= SSE_KEEPALIVE_INTERVAL:
+                await _send_event(send, SSE_KEEPALIVE)
+                last_sent = time.monotonic()
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+    finally:
+        watcher.cancel()
+
+
+def _job_state(job):
+    # One read of everything an event stream needs: (done, progress version, payload)
+    if job.done:
+        return True, None, job.to_dict()
+    return False, job.progress_version, dict(job.progress or {})
+
+
+async def _off_loop(func, *args):
+    # A shared state store may block on locks held by other processes;
+    # the in-process store is only memory access
+    if job_manager.store.shared:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+async def _send_event(send, text, more=True):
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': more})
+
+
+class Application:
+    """ASGI application: native event streams, everything else through Flask."""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.bridge = WsgiBridge(wsgi_app, threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        match = JOB_EVENTS_RE.match(scope['path'])
+        if match and scope['method'] == 'GET':
+            job = await _off_loop(job_manager.get, match.group(1))
+            if job:
+                await job_events(job, receive, send)
+                return
+        # Unknown jobs fall through so Flask renders the usual 404
+        await self.bridge(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.get_running_loop().run_in_executor(self.bridge.executor, start_services)
+                await send({'type': 'lifespan.startup.complete'})
+                logger.info(startup.report.format())
+                if PREWARM:
+                    # Runs in the background while the server binds its socket
+                    start_prewarm()
+            elif message['type'] == 'lifespan.shutdown':
+                self.bridge.executor.shutdown(wait=False, cancel_futures=True)
+                self.bridge.stream_executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = Application(app)
@@ -0,0 +1,179 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from admission import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Priorities: interactive single videos and bulk playlists
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Share of the budget a job gets relative to the other active jobs
+WEIGHTS = {INTERACTIVE: 4, BULK: 1}
+
+# Order in which waiting downloads get a download slot (lower first)
+SLOT_PRIORITIES = {INTERACTIVE: 0, BULK: 1}
+
+# Smallest burst a job may receive at once, so single reads never stall
+MIN_BURST = 256 * 1024
+
+
+class Lease:
+    """
+    One job's part of the global bandwidth budget. The job only counts
+    towards the split while a transfer() block runs, not while it waits
+    for a slot, looks up the cache or transcodes.
+
+    Attributes:
+        priority (str): INTERACTIVE or BULK
+        fragments (int): Fragments the job may fetch concurrently
+        slot_priority (int): Priority for SlotPool.slot()
+    """
+
+    def __init__(self, scheduler, job_id, priority, fragments):
+        self.job_id = job_id
+        self.priority = priority
+        self.weight = WEIGHTS[priority]
+        self.slot_priority = SLOT_PRIORITIES[priority]
+        self.fragments = fragments
+        self.bytes = 0
+        self.throttled_seconds = 0.0
+        # Running transfers; playlist entries of one job share the lease
+        self.transfers = 0
+        self._scheduler = scheduler
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transfer(self):
+        """Counts the job as downloading for the enclosed block."""
+        self._scheduler._start_transfer(self)
+        try:
+            yield self
+        finally:
+            self._scheduler._end_transfer(self)
+
+    def throttle(self, received):
+        """
+        Accounts for bytes just received.
+
+        Args:
+            received (int): Bytes received since the last call
+
+        Returns:
+            float: Seconds the download should pause to stay within its share
+        """
+        with self._lock:
+            self.bytes += received
+            if self._bucket is None:
+                return 0.0
+            wait = self._bucket.consume(received)
+            self.throttled_seconds += wait
+        return wait
+
+    def set_rate(self, rate, burst, reset=False):
+        with self._lock:
+            if self._bucket is None or reset:
+                self._bucket = TokenBucket(rate, burst)
+                # Start empty: a full bucket per new job would overshoot the budget
+                self._bucket.tokens = 0
+                return
+            # Settle what was earned at the old rate before switching
+            self._bucket.consume(0)
+            self._bucket.rate = rate
+            self._bucket.burst = burst
+
+
+class BandwidthScheduler:
+    """
+    Splits this process's download budget among the jobs that are downloading.
+
+    Every job holds a Lease. While it transfers data it gets
+    rate * weight / total weight of the transferring jobs, recomputed
+    whenever a transfer starts or ends, so a job alone may use the whole
+    budget and interactive jobs get WEIGHTS[INTERACTIVE] times the share
+    of bulk ones. Jobs pace themselves through Lease.throttle() from their
+    progress hook. The lease also tells how many fragments a job may fetch
+    at once and where it queues for a download slot.
+
+    The budget is per process; several server processes do not coordinate,
+    so each one must be given its part of the host budget (see app.py).
+
+    Args:
+        rate (int): Budget in bytes per second; 0 only hands out fragment counts
+        burst_seconds (float): Seconds of its share a job may receive in one go
+        fragments (dict): Concurrent fragment downloads per priority
+    """
+
+    def __init__(self, rate=0, burst_seconds=1.0, fragments=None):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.fragments = fragments or {INTERACTIVE: 4, BULK: 2}
+        self._leases = {}
+        self._lock = threading.Lock()
+        self.completed_bytes = 0
+        self.throttled_seconds = 0.0
+
+    @contextmanager
+    def lease(self, job_id, priority=INTERACTIVE):
+        """
+        Registers a job for the enclosed block; its share is only taken
+        inside Lease.transfer().
+
+        Args:
+            job_id (str): The downloading job
+            priority (str): INTERACTIVE or BULK
+
+        Yields:
+            Lease: The job's share
+        """
+        lease = Lease(self, job_id, priority, self.fragments[priority])
+        with self._lock:
+            self._leases[job_id] = lease
+        try:
+            yield lease
+        finally:
+            with self._lock:
+                del self._leases[job_id]
+                self.completed_bytes += lease.bytes
+                self.throttled_seconds += lease.throttled_seconds
+
+    def stats(self):
+        with self._lock:
+            leases = list(self._leases.values())
+            completed_bytes = self.completed_bytes
+            throttled_seconds = self.throttled_seconds
+        return {
+            'rate': self.rate,
+            'fragments': self.fragments,
+            'jobs': {priority: sum(1 for lease in leases if lease.priority == priority) for priority in WEIGHTS},
+            'active': {
+                priority: sum(1 for lease in leases if lease.priority == priority and lease.transfers)
+                for priority in WEIGHTS
+            },
+            'bytes': completed_bytes + sum(lease.bytes for lease in leases),
+            'throttled_seconds': round(throttled_seconds + sum(lease.throttled_seconds for lease in leases), 3),
+        }
+
+    def _start_transfer(self, lease):
+        with self._lock:
+            lease.transfers += 1
+            self._rebalance(started=lease if lease.transfers == 1 else None)
+
+    def _end_transfer(self, lease):
+        with self._lock:
+            lease.transfers -= 1
+            self._rebalance()
+
+    def _rebalance(self, started=None):
+        # Caller must hold self._lock
+        active = [lease for lease in self._leases.values() if lease.transfers]
+        if not self.rate or not active:
+            return
+        total = sum(lease.weight for lease in active)
+        for lease in active:
+            share = self.rate * lease.weight / total
+            # A job resuming after a pause starts empty, like a new one
+            lease.set_rate(share, max(share * self.burst_seconds, MIN_BURST), reset=lease is started)
@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+import yt_dlp
+
+CHUNK_SIZE = 256 * 1024
+
+
+def video_url(video_id):
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+def playlist_url(playlist_id):
+    return f'https://www.youtube.com/playlist?list={playlist_id}'
+
+
+def bench_video_id(n):
+    """Returns a valid 11-character video ID for the n-th synthetic video."""
+    return f'bench{n:06d}'
+
+
+def bench_playlist_id(n, count):
+    """Returns the ID of the n-th synthetic playlist with count entries."""
+    return f'PL{n:05d}_{count}'
+
+
+class FakeYoutubeDL:
+    """
+    Deterministic stand-in for yt_dlp.YoutubeDL.
+
+    Implements the subset of the API the app uses. Videos resolve to two
+    formats (a progressive MP4 and an M4A audio stream) served by a
+    MediaServer; playlists named PL<5 characters>_<count> contain `count`
+    videos. Downloads stream from the media server and report through the regular
+    progress hooks, so cancellation and progress behave as with yt-dlp.
+    With concurrent_fragment_downloads > 1 a file is fetched as that many
+    byte ranges in parallel, like yt-dlp does for DASH/HLS fragments.
+
+    Install with install(media_server), which patches yt_dlp.YoutubeDL for
+    every module that reaches it through the yt_dlp package.
+    """
+
+    media_server = None
+    duration = 300
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def get_info_extractor(self, ie_key):
+        return None
+
+    def extract_info(self, url, download=True, **kwargs):
+        query = parse_qs(urlparse(url).query)
+        if 'list' in query and not (self.params.get('noplaylist') and 'v' in query):
+            return self._playlist_info(query['list'][0])
+        info = self._video_info(query['v'][0])
+        if download:
+            self._download(info)
+        return info
+
+    def prepare_filename(self, info):
+        home = (self.params.get('paths') or {}).get('home', '.')
+        outtmpl = self.params.get('outtmpl') or '%(title)s.%(ext)s'
+        if isinstance(outtmpl, dict):
+            outtmpl = outtmpl.get('default', '%(title)s.%(ext)s')
+        return os.path.join(home, outtmpl % info)
+
+    def urlopen(self, request):
+        return urllib.request.urlopen(request.url)
+
+    def _playlist_info(self, playlist_id):
+        count = int(playlist_id.rsplit('_', 1)[1])
+        first, last = 1, count
+        items = self.params.get('playlist_items')
+        if items:
+            start, _, end = str(items).partition(':')
+            first, last = int(start or 1), min(int(end or count), count)
+        entries = []
+        for index in range(first, last + 1):
+            # Derive entry IDs from the playlist so different playlists don't share videos
+            video_id = f'{playlist_id[2:7]}{index:06d}'
+            entry = {'_type': 'url', 'id': video_id, 'url': video_url(video_id), 'title': f'Video {video_id}'}
+            if not self.params.get('extract_flat'):
+                entry = self._video_info(video_id)
+            entries.append(entry)
+        return {
+            '_type': 'playlist',
+            'id': playlist_id,
+            'title': f'Playlist {playlist_id}',
+            'playlist_count': count,
+            'entries': entries,
+        }
+
+    def _video_info(self, video_id):
+        size = self.media_server.size
+        formats = [
+            {
+                'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2',
+                'height': 360, 'format_note': '360p', 'filesize': size,
+                'url': self.media_server.url_for(video_id, 'mp4'), 'protocol': 'https',
+            },
+            {
+                'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2',
+                'abr': 129, 'format_note': 'medium', 'filesize': size // 8,
+                'url': self.media_server.url_for(video_id, 'm4a'), 'protocol': 'https',
+            },
+        ]
+        info = {
+            'id': video_id,
+            'title': f'Video {video_id}',
+            'uploader': 'Benchmark',
+            'upload_date': '20250101',
+            'duration': self.duration,
+            'thumbnail': None,
+            'webpage_url': video_url(video_id),
+            'formats': formats,
+        }
+        selected = self._select(formats, self.params.get('format') or 'best')
+        info.update({key: selected[key] for key in ('format_id', 'ext', 'vcodec', 'acodec', 'url', 'protocol')})
+        return info
+
+    def _select(self, formats, selector):
+        by_id = {fmt['format_id']: fmt for fmt in formats}
+        for alternative in selector.split('/'):
+            if alternative in by_id:
+                return by_id[alternative]
+            if alternative.startswith('bestaudio'):
+                return by_id['140']
+            if alternative.startswith('best'):
+                return by_id['18']
+        return by_id['18']
+
+    def _download(self, info):
+        path = self.prepare_filename(info)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        hooks = self.params.get('progress_hooks') or []
+        started = time.monotonic()
+        fragments = int(self.params.get('concurrent_fragment_downloads') or 1)
+        if fragments > 1:
+            downloaded, total = self._download_fragments(info, path, hooks, started, fragments)
+            self._report(hooks, 'finished', path, info, downloaded, total, started)
+            info['requested_downloads'] = [{'filepath': path}]
+            info['filepath'] = path
+            return
+        downloaded = 0
+        with urllib.request.urlopen(info['url']) as response, open(path, 'wb') as f:
+            total = int(response.headers.get('Content-Length') or 0)
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                downloaded += len(chunk)
+                self._report(hooks, 'downloading', path, info, downloaded, total, started)
+        self._report(hooks, 'finished', path, info, downloaded, total, started)
+        info['requested_downloads'] = [{'filepath': path}]
+        info['filepath'] = path
+
+    def _download_fragments(self, info, path, hooks, started, fragments):
+        with urllib.request.urlopen(urllib.request.Request(info['url'], method='HEAD')) as response:
+            total = int(response.headers.get('Content-Length') or 0)
+        with open(path, 'wb') as f:
+            f.truncate(total)
+        downloaded = [0]
+        lock = threading.Lock()
+        step = -(-total // fragments)
+
+        def fetch(start):
+            end = min(start + step, total) - 1
+            request = urllib.request.Request(info['url'], headers={'Range': f'bytes={start}-{end}'})
+            with urllib.request.urlopen(request) as response, open(path, 'r+b') as f:
+                f.seek(start)
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    with lock:
+                        downloaded[0] += len(chunk)
+                        current = downloaded[0]
+                    self._report(hooks, 'downloading', path, info, current, total, started)
+
+        with ThreadPoolExecutor(max_workers=fragments) as pool:
+            # list() re-raises the first failure, e.g. DownloadCancelled from a hook
+            list(pool.map(fetch, range(0, total, step)))
+        return downloaded[0], total
+
+    def _report(self, hooks, status, path, info, downloaded, total, started):
+        elapsed = time.monotonic() - started
+        for hook in hooks:
+            hook({
+                'status': status,
+                'filename': path,
+                'info_dict': info,
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'elapsed': elapsed,
+                'speed': downloaded / elapsed if elapsed else None,
+                'eta': None,
+            })
+
+
+def install(media_server):
+    """Routes every yt_dlp.YoutubeDL instance to FakeYoutubeDL backed by media_server."""
+    FakeYoutubeDL.media_server = media_server
+    yt_dlp.YoutubeDL = FakeYoutubeDL
@@ -0,0 +1,117 @@
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK_SIZE = 64 * 1024
+
+# /<video id>.<ext>
+PATH_RE = re.compile(r'^/([A-Za-z0-9_-]+)\.(\w+)$')
+
+# Single byte range, e.g. bytes=0-1023 or bytes=1024-
+RANGE_RE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class MediaServer:
+    """
+    Local HTTP server that serves synthetic media files.
+
+    Every path of the form /<id>.<ext> returns `size` deterministic bytes,
+    sent at most `rate` bytes per second per connection (0 = unthrottled).
+    Single byte ranges are honoured, so clients can fetch a file over
+    several connections the way fragmented downloads do.
+
+    Args:
+        size (int): Bytes per file
+        rate (int): Per-connection send rate in bytes per second
+        host (str): Interface to bind
+        port (int): Port to bind; 0 picks a free one
+    """
+
+    def __init__(self, size=5 * 1024 ** 2, rate=0, host='127.0.0.1', port=0):
+        self.size = size
+        self.rate = rate
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url_for(self, video_id, ext):
+        return f'{self.base_url}/{video_id}.{ext}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='media-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+        # Deterministic payload; the content is irrelevant, only the volume counts
+        chunk = bytes(range(256)) * (CHUNK_SIZE // 256)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                self._send_headers()
+
+            def do_GET(self):
+                remaining = self._send_headers()
+                if remaining is None:
+                    return
+                started = time.monotonic()
+                sent = 0
+                try:
+                    while remaining > 0:
+                        data = chunk[:min(CHUNK_SIZE, remaining)]
+                        self.wfile.write(data)
+                        remaining -= len(data)
+                        sent += len(data)
+                        if server.rate:
+                            # Sleep until the send rate is back under the limit
+                            delay = sent / server.rate - (time.monotonic() - started)
+                            if delay > 0:
+                                time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                with server._lock:
+                    server.bytes_sent += sent
+
+            def _send_headers(self):
+                # Returns the number of body bytes to send, or None after an error
+                if not PATH_RE.match(self.path.split('?', 1)[0]):
+                    self.send_error(404)
+                    return None
+                match = RANGE_RE.match(self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or server.size - 1), server.size - 1)
+                    if start > end:
+                        self.send_error(416)
+                        return None
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{server.size}')
+                    length = end - start + 1
+                else:
+                    self.send_response(200)
+                    length = server.size
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(length))
+                self.end_headers()
+                return length
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,332 @@
+"""
+Offline benchmark for the download service.
+
+Runs the Flask app in-process against a fake yt-dlp and a local media
+server, drives it with concurrent virtual users and reports latency
+percentiles, throughput, peak RSS and disk usage per scenario.
+
+    python benchmarks/run.py --concurrency 8 --requests 40 --size-mb 5
+
+Scenarios:
+    single     info -> download -> result -> /serve_download, new video each time
+    playlist   the same for a playlist, fetched as one streamed ZIP
+    audio      single video converted to MP3 (needs ffmpeg)
+    cache_hit  the same video over and over, served from the caches
+    mixed      half the users download playlists, the others single videos;
+               latency is reported per kind (run with --rate-kb/--bandwidth-kb)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from media_server import MediaServer
+from storage import directory_stats
+import fake_ytdlp
+
+SCENARIOS = ('single', 'playlist', 'audio', 'cache_hit', 'mixed')
+FINAL_STATES = ('finished', 'failed', 'cancelled')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values (0 if empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def current_rss():
+    # Resident set size in bytes, from /proc where available
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """Samples the process RSS in the background and keeps the peak."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+class Recorder:
+    """Thread-safe collection of request and flow timings."""
+
+    def __init__(self):
+        self.requests = {}
+        self.flows = []
+        self.flow_kinds = {}
+        self.errors = []
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, seconds, size=0):
+        with self._lock:
+            self.requests.setdefault(endpoint, []).append(seconds)
+            self.bytes_received += size
+
+    def flow(self, seconds, kind):
+        with self._lock:
+            self.flows.append(seconds)
+            self.flow_kinds.setdefault(kind, []).append(seconds)
+
+    def error(self, message):
+        with self._lock:
+            self.errors.append(message)
+
+
+class VirtualUser:
+    """One client session (own cookie jar) running complete download flows."""
+
+    def __init__(self, app, recorder, job_timeout):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.job_timeout = job_timeout
+
+    def call(self, endpoint, method, path, **kwargs):
+        started = time.monotonic()
+        response = self.client.open(path, method=method, **kwargs)
+        self.recorder.request(endpoint, time.monotonic() - started)
+        return response
+
+    def fetch(self, endpoint, path):
+        # Stream the body instead of buffering it, like a real client would
+        started = time.monotonic()
+        response = self.client.get(path, buffered=False)
+        if response.status_code in (301, 302, 303, 307):
+            response.close()
+            response = self.client.get(response.headers['Location'], buffered=False)
+        size = 0
+        try:
+            for chunk in response.response:
+                size += len(chunk)
+        finally:
+            response.close()
+        self.recorder.request(endpoint, time.monotonic() - started, size)
+        if response.status_code != 200:
+            raise RuntimeError(f'{endpoint} returned {response.status_code}')
+        return size
+
+    def run(self, url, download_type='video', audio_format=None):
+        started = time.monotonic()
+        response = self.call('get_video_info', 'POST', '/get_video_info', data={'url': url})
+        if response.status_code != 200:
+            raise RuntimeError(f'get_video_info returned {response.status_code}')
+        info = response.get_json()
+        formats = info['audio_formats'] if download_type == 'audio' else info['formats']
+
+        data = {'format': formats[0]['id'], 'type': download_type, 'is_playlist': str(info['is_playlist']).lower()}
+        if audio_format:
+            data['audio_format'] = audio_format
+        response = self.call('download', 'POST', '/download', data=data)
+        if response.status_code != 202:
+            raise RuntimeError(f"download returned {response.status_code}: {response.get_json()}")
+        job = response.get_json()
+
+        deadline = time.monotonic() + self.job_timeout
+        while True:
+            status = self.call('job_status', 'GET', job['status_url']).get_json()
+            if status['status'] in FINAL_STATES:
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"job {job['job_id']} timed out")
+            time.sleep(0.02)
+        if status['status'] != 'finished':
+            raise RuntimeError(f"job {job['job_id']} {status['status']}: {status.get('error')}")
+
+        result = self.call('job_result', 'GET', job['result_url']).get_json()
+        if info['is_playlist']:
+            self.fetch('zip', result['download_link'])
+        else:
+            self.fetch('serve_download', '/serve_download')
+        self.recorder.flow(time.monotonic() - started, 'playlist' if info['is_playlist'] else 'single')
+
+
+def disk_usage(paths):
+    return sum(directory_stats(path)[0] for path in paths if os.path.exists(path))
+
+
+def run_scenario(app_module, server, name, args, sequence):
+    recorder = Recorder()
+    download_type, audio_format = ('audio', 'mp3') if name == 'audio' else ('video', None)
+
+    def next_url(playlist=False):
+        if name == 'playlist' or playlist:
+            return fake_ytdlp.playlist_url(fake_ytdlp.bench_playlist_id(next(sequence), args.playlist_size))
+        if name == 'cache_hit':
+            return fake_ytdlp.video_url(fake_ytdlp.bench_video_id(0))
+        return fake_ytdlp.video_url(fake_ytdlp.bench_video_id(next(sequence)))
+
+    if name == 'cache_hit':
+        # Warm the metadata and media caches outside the measurement
+        VirtualUser(app_module.app, Recorder(), args.job_timeout).run(next_url())
+
+    remaining = itertools.count()
+
+    def worker(index):
+        user = VirtualUser(app_module.app, recorder, args.job_timeout)
+        while next(remaining) < args.requests:
+            try:
+                user.run(next_url(name == 'mixed' and index % 2 == 0), download_type, audio_format)
+            except Exception as e:
+                recorder.error(str(e))
+
+    upstream_before = server.bytes_sent
+    started = time.monotonic()
+    with RssSampler() as rss:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for index in range(args.concurrency):
+                pool.submit(worker, index)
+    elapsed = time.monotonic() - started
+
+    requests = sum(len(timings) for timings in recorder.requests.values())
+    return {
+        'scenario': name,
+        'concurrency': args.concurrency,
+        'flows': len(recorder.flows),
+        'errors': len(recorder.errors),
+        'first_error': recorder.errors[0] if recorder.errors else None,
+        'elapsed_s': round(elapsed, 3),
+        'flows_per_s': round(len(recorder.flows) / elapsed, 2),
+        'requests_per_s': round(requests / elapsed, 2),
+        'p50_s': round(percentile(recorder.flows, 50), 4),
+        'p95_s': round(percentile(recorder.flows, 95), 4),
+        'p99_s': round(percentile(recorder.flows, 99), 4),
+        'served_bytes_per_s': round(recorder.bytes_received / elapsed),
+        'upstream_bytes_per_s': round((server.bytes_sent - upstream_before) / elapsed),
+        'peak_rss_mb': round(rss.peak / 1024 ** 2, 1),
+        'disk_mb': round(disk_usage(['downloads', 'cache']) / 1024 ** 2, 1),
+        'endpoints': {
+            endpoint: {
+                'count': len(timings),
+                'p50_s': round(percentile(timings, 50), 4),
+                'p95_s': round(percentile(timings, 95), 4),
+                'p99_s': round(percentile(timings, 99), 4),
+            }
+            for endpoint, timings in sorted(recorder.requests.items())
+        },
+        'flow_kinds': {
+            kind: {
+                'count': len(timings),
+                'p50_s': round(percentile(timings, 50), 4),
+                'p95_s': round(percentile(timings, 95), 4),
+                'p99_s': round(percentile(timings, 99), 4),
+            }
+            for kind, timings in sorted(recorder.flow_kinds.items())
+        },
+    }
+
+
+def print_report(results):
+    columns = ('scenario', 'flows', 'errors', 'p50_s', 'p95_s', 'p99_s', 'flows_per_s', 'requests_per_s',
+               'served_bytes_per_s', 'peak_rss_mb', 'disk_mb')
+    widths = [max(len(column), *(len(str(result.get(column, ''))) for result in results)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print('  '.join(str(result.get(column, '')).ljust(width) for column, width in zip(columns, widths)))
+        timings = list(result.get('endpoints', {}).items())
+        if len(result.get('flow_kinds', {})) > 1:
+            timings += [(f'flow:{kind}', timing) for kind, timing in result['flow_kinds'].items()]
+        for endpoint, timing in timings:
+            print(f"    {endpoint:<16} n={timing['count']:<6} p50={timing['p50_s']:<8} "
+                  f"p95={timing['p95_s']:<8} p99={timing['p99_s']}")
+        if result.get('first_error'):
+            print(f"    first error: {result['first_error']}")
+        if result.get('skipped'):
+            print(f"    skipped: {result['skipped']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenarios to run')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent virtual users')
+    parser.add_argument('--requests', type=int, default=20, help='Flows per scenario')
+    parser.add_argument('--size-mb', type=float, default=2, help='Size of each synthetic media file')
+    parser.add_argument('--rate-kb', type=int, default=0, help='Per-connection media server rate in KiB/s (0 = unlimited)')
+    parser.add_argument('--bandwidth-kb', type=int, default=0,
+                        help='Global download budget of the app in KiB/s (0 = unlimited)')
+    parser.add_argument('--playlist-size', type=int, default=20, help='Entries per playlist')
+    parser.add_argument('--job-timeout', type=float, default=300, help='Seconds to wait for one job')
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg'), help='ffmpeg executable for the audio scenario')
+    parser.add_argument('--workdir', help='Directory for downloads, caches and logs (default: a temporary one)')
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.json_path:
+        args.json_path = os.path.abspath(args.json_path)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ytdl-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    # All virtual users share one address; lift the per-client limits unless set explicitly
+    for name, value in (('INFO_RATE', '100000'), ('INFO_BURST', '100000'), ('DOWNLOAD_RATE', '100000'),
+                        ('DOWNLOAD_BURST', '100000'), ('MAX_JOBS_PER_IP', '100000')):
+        os.environ.setdefault(name, value)
+    if args.bandwidth_kb:
+        os.environ['DOWNLOAD_BANDWIDTH'] = str(args.bandwidth_kb * 1024)
+
+    server = MediaServer(size=int(args.size_mb * 1024 ** 2), rate=args.rate_kb * 1024).start()
+    fake_ytdlp.install(server)
+    import app as app_module
+    if args.ffmpeg:
+        app_module.audio_transcoder.ffmpeg = args.ffmpeg
+
+    sequence = itertools.count(1)
+    results = []
+    try:
+        for name in scenarios:
+            if name == 'audio' and not args.ffmpeg:
+                results.append({'scenario': name, 'skipped': 'ffmpeg not found (use --ffmpeg)'})
+                continue
+            results.append(run_scenario(app_module, server, name, args, sequence))
+    finally:
+        server.stop()
+
+    print(f'workdir: {workdir}')
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+import os
+import json
+import logging
+import hashlib
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from state import MemoryStateStore
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """An in-progress load that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MetadataCache:
+    """
+    Bounded in-memory cache with TTL expiry, LRU eviction and single-flight
+    loading: concurrent misses for the same key share one loader call.
+
+    Loader results of None are treated as failures and are not cached.
+    Only calls that run the loader count as misses; callers that wait for
+    another call's load count as hits and as coalesced.
+
+    Args:
+        max_entries (int): Maximum number of cached values
+        ttl (int): Seconds a cached value stays valid
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def peek(self, key):
+        """Like get(), but leaves the hit and miss counters alone."""
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() on a miss. If
+        another thread is already loading key, waits for its result instead.
+
+        Args:
+            key (str): Cache key
+            loader (callable): Produces the value; may raise or return None
+
+        Returns:
+            The cached or freshly loaded value
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            flight = self._flights.get(key)
+            if flight:
+                # Served without a load of its own: a hit, also counted as coalesced
+                self.hits += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.event.wait()
+            if flight.error:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.value is not None:
+                    self._store(key, flight.value)
+                del self._flights[key]
+            flight.event.set()
+        return flight.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _lookup(self, key):
+        # Caller must hold self._lock and count the hit or miss
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        # Caller must hold self._lock
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+class MediaCache:
+    """
+    Content-addressed on-disk cache for finished downloads.
+
+    Entries are keyed by a digest of (video ID, format selector,
+    postprocessor settings) and live in root/<digest>/. Publishing moves
+    files into a temporary directory first and renames it into place, so
+    readers never see half-written entries. When the total size exceeds
+    max_bytes the least recently used entries are evicted, skipping any
+    that are pinned by an ongoing send or by the pinned() callback.
+
+    The index lives in the state store, so processes sharing a store and
+    the cache directory share one cache.
+
+    Args:
+        root (str): Cache directory
+        max_bytes (int): Disk budget in bytes
+        store (StateStore): Where the index is kept (default: in-process)
+        pinned (callable): Returns digests referenced elsewhere, e.g. by download tokens
+    """
+
+    META_FILE = 'meta.json'
+
+    # Temporary publish directories younger than this may belong to another process
+    STALE_TEMP_AGE = 3600
+
+    def __init__(self, root='cache/media', max_bytes=10 * 1024 ** 3, store=None, pinned=None):
+        # Resolved once, so lookup() and publish() hand out absolute paths
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.store = store or MemoryStateStore()
+        self.pinned = pinned or set
+        self._refs = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._opened = False
+
+    def open(self):
+        """Creates the cache directory and indexes entries found on disk; idempotent."""
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(video_id, format_id, postprocessors=None):
+        """
+        Returns the digest identifying one rendition of a video.
+
+        Args:
+            video_id (str): Canonical video ID
+            format_id (str): yt-dlp format selector
+            postprocessors (list): yt-dlp postprocessor settings
+        """
+        material = json.dumps([video_id, format_id, postprocessors or []], sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:32]
+
+    def lookup(self, digest):
+        """
+        Returns the cached entry for digest or None. A hit marks the entry as
+        most recently used.
+
+        Returns:
+            dict: {'files': [absolute paths], 'title': str}
+        """
+        entry = self.store.get('media', digest)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        files = [os.path.join(self.root, digest, name) for name in entry['files']]
+        if not all(os.path.exists(path) for path in files):
+            # Removed behind our back; forget about it
+            with self._lock:
+                self._drop(digest)
+                self.misses += 1
+            return None
+        entry['used_at'] = time.time()
+        self.store.put('media', digest, entry)
+        with self._lock:
+            self.hits += 1
+        try:
+            os.utime(os.path.join(self.root, digest, self.META_FILE))
+        except OSError:
+            pass
+        return {'files': files, 'title': entry.get('title')}
+
+    def publish(self, digest, paths, title=None):
+        """
+        Moves finished files into the cache. Files larger than the whole
+        budget are left where they are.
+
+        Args:
+            digest (str): Key from make_key()
+            paths (list): Files to publish
+            title (str): Title stored with the entry
+
+        Returns:
+            list: The paths the files can now be read from
+        """
+        size = sum(os.path.getsize(path) for path in paths)
+        if not paths or size > self.max_bytes:
+            return paths
+
+        final_dir = os.path.join(self.root, digest)
+        temp_dir = os.path.join(self.root, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(temp_dir)
+        names = []
+        for path in paths:
+            name = os.path.basename(path)
+            shutil.move(path, os.path.join(temp_dir, name))
+            names.append(name)
+        with open(os.path.join(temp_dir, self.META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'files': names, 'title': title, 'size': size}, f)
+
+        try:
+            os.rename(temp_dir, final_dir)
+        except OSError:
+            # Another job published the same rendition first; use theirs
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            entry = self.lookup(digest)
+            if entry:
+                return entry['files']
+            raise
+
+        self.store.put('media', digest, {'files': names, 'title': title, 'size': size, 'used_at': time.time()})
+        with self._lock:
+            self._evict()
+        return [os.path.join(final_dir, name) for name in names]
+
+    def digest_for_path(self, path):
+        """Returns the digest of the entry containing path, or None."""
+        parent = os.path.dirname(os.path.abspath(path))
+        if os.path.dirname(parent) != self.root:
+            return None
+        return os.path.basename(parent)
+
+    def acquire(self, digest):
+        """Pins an entry so it is not evicted until release() is called."""
+        if not digest:
+            return
+        with self._lock:
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+
+    def release(self, digest):
+        if not digest:
+            return
+        with self._lock:
+            count = self._refs.get(digest, 0) - 1
+            if count > 0:
+                self._refs[digest] = count
+            else:
+                self._refs.pop(digest, None)
+            self._evict()
+
+    def stats(self):
+        entries = self.store.scan('media')
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(entries),
+                'bytes': sum(entry.get('size', 0) for _, entry in entries),
+                'max_bytes': self.max_bytes,
+                'pinned': len(self._refs),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _load(self):
+        # Index entries on disk that the store does not know about yet
+        # (first start, or a store that was reset), keeping their last access
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.tmp-'):
+                # Leftover from an interrupted publish, unless another process is still at it
+                try:
+                    if time.time() - os.path.getmtime(path) > self.STALE_TEMP_AGE:
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            if self.store.get('media', name):
+                continue
+            meta_path = os.path.join(path, self.META_FILE)
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                meta['used_at'] = os.path.getmtime(meta_path)
+            except (OSError, ValueError):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            self.store.put('media', name, meta)
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        # Caller must hold self._lock
+        entries = sorted(self.store.scan('media'), key=lambda item: item[1].get('used_at', 0))
+        self.total_bytes = sum(entry.get('size', 0) for _, entry in entries)
+        if self.total_bytes <= self.max_bytes:
+            return
+        pinned = set(self._refs) | set(self.pinned())
+        for digest, entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if digest in pinned:
+                continue
+            self._drop(digest, entry)
+            self.evictions += 1
+
+    def _drop(self, digest, entry=None):
+        # Caller must hold self._lock
+        entry = entry or self.store.get('media', digest) or {}
+        if self.store.delete('media', digest):
+            self.total_bytes -= entry.get('size', 0)
+        shutil.rmtree(os.path.join(self.root, digest), ignore_errors=True)
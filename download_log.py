@@ -0,0 +1,248 @@
+import os
+import glob
+import json
+import itertools
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import datetime
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadLog:
+    """
+    Structured download log written by a background thread.
+
+    Request threads only enqueue records. The writer appends them in batches
+    as JSON lines and fsyncs at most every fsync_interval seconds, but also
+    no later than that after a write, even if no further records arrive. It
+    rotates the file when it exceeds max_bytes or is older than rotate_interval.
+    Each batch is also folded into a small SQLite index of per-day, per-video
+    aggregates, so queries never rescan the log files.
+
+    Every process writes and rotates a file of its own, path with the pid
+    inserted (logs/downloads-<pid>.jsonl), so server processes never append
+    to or rename each other's file. They share the index; the one that
+    creates it also fills it from the existing logs, while the others wait.
+
+    Args:
+        path (str): Log file name; the pid is inserted before the extension
+        index_path (str): SQLite aggregate index
+        max_bytes (int): Rotate when the log grows beyond this size
+        rotate_interval (int): Rotate when the log is older than this (seconds)
+        fsync_interval (float): Minimum seconds between fsyncs
+        batch_size (int): Maximum records written per batch
+        max_queue (int): Records buffered before new ones are dropped
+    """
+
+    def __init__(self, path='logs/downloads.jsonl', index_path='logs/downloads_index.sqlite3',
+                 max_bytes=50 * 1024 ** 2, rotate_interval=86400, fsync_interval=5.0,
+                 batch_size=500, max_queue=10000):
+        self.path = path
+        self.active_path = None
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            log_dir = os.path.dirname(self.path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            # Set here rather than in __init__, which may run before the fork
+            base, ext = os.path.splitext(self.path)
+            self.active_path = f'{base}-{os.getpid()}{ext}'
+            self._init_index()
+            self._thread = threading.Thread(target=self._run, name='download-log', daemon=True)
+            self._thread.start()
+
+    def log(self, **record):
+        """
+        Queues a record. Never blocks; if the writer has fallen behind by
+        max_queue records the record is dropped and counted.
+        """
+        record.setdefault('timestamp', time.time())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5):
+        """Waits until all queued records have been written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def top_videos(self, days=7, limit=10):
+        """
+        Returns the most downloaded videos of the last days.
+
+        Returns:
+            list: Dicts with video_id, title, downloads and bytes
+        """
+        rows = self._query(
+            'SELECT video_id, MAX(title), SUM(downloads), SUM(bytes) FROM daily '
+            'WHERE day >= ? GROUP BY video_id ORDER BY SUM(downloads) DESC, SUM(bytes) DESC LIMIT ?',
+            (self._since(days), limit),
+        )
+        return [
+            {'video_id': video_id, 'title': title, 'downloads': downloads, 'bytes': size}
+            for video_id, title, downloads, size in rows
+        ]
+
+    def bytes_per_day(self, days=30):
+        """
+        Returns downloads and bytes per day for the last days.
+
+        Returns:
+            list: Dicts with day, downloads and bytes, oldest first
+        """
+        rows = self._query(
+            'SELECT day, SUM(downloads), SUM(bytes) FROM daily WHERE day >= ? GROUP BY day ORDER BY day',
+            (self._since(days),),
+        )
+        return [{'day': day, 'downloads': downloads, 'bytes': size} for day, downloads, size in rows]
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+        }
+
+    def _run(self):
+        log_file = open(self.active_path, 'a', encoding='utf-8')
+        opened_at = time.time()
+        last_fsync = time.monotonic()
+        unsynced = False
+        index = sqlite3.connect(self.index_path)
+        while True:
+            # With unsynced data, wait no longer than until the next fsync is due
+            timeout = max(0.0, self.fsync_interval - (time.monotonic() - last_fsync)) if unsynced else None
+            try:
+                batch = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                try:
+                    os.fsync(log_file.fileno())
+                except OSError as e:
+                    logger.error(f"Error syncing download log: {e}")
+                last_fsync = time.monotonic()
+                unsynced = False
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for record in batch:
+                    log_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                log_file.flush()
+                unsynced = True
+                if time.monotonic() - last_fsync >= self.fsync_interval:
+                    os.fsync(log_file.fileno())
+                    last_fsync = time.monotonic()
+                    unsynced = False
+                self._index_batch(index, batch)
+                self.written += len(batch)
+
+                if log_file.tell() >= self.max_bytes or time.time() - opened_at >= self.rotate_interval:
+                    log_file = self._rotate(log_file)
+                    opened_at = time.time()
+                    unsynced = False
+            except Exception as e:
+                logger.error(f"Error writing download log: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _rotate(self, log_file):
+        os.fsync(log_file.fileno())
+        log_file.close()
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        base, ext = os.path.splitext(self.active_path)
+        target = f'{base}-{stamp}{ext}'
+        # Several rotations within one second must not replace each other
+        counter = itertools.count(1)
+        while os.path.exists(target):
+            target = f'{base}-{stamp}-{next(counter)}{ext}'
+        os.rename(self.active_path, target)
+        return open(self.active_path, 'a', encoding='utf-8')
+
+    def _init_index(self):
+        # The write lock makes processes starting together take turns, so
+        # only the one that creates the table rebuilds it from the logs
+        with closing(sqlite3.connect(self.index_path, timeout=60, isolation_level=None)) as index:
+            index.execute('PRAGMA journal_mode=WAL')
+            index.execute('BEGIN IMMEDIATE')
+            try:
+                exists = index.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily'"
+                ).fetchone()
+                if not exists:
+                    index.execute(
+                        'CREATE TABLE daily ('
+                        'day TEXT NOT NULL, video_id TEXT NOT NULL, title TEXT, '
+                        'downloads INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0, '
+                        'PRIMARY KEY (day, video_id))'
+                    )
+                    self._rebuild_index(index)
+                index.commit()
+            except BaseException:
+                index.rollback()
+                raise
+
+    def _rebuild_index(self, index):
+        # One-off scan of existing logs (including the single file written
+        # before logs were per process) when the index is created
+        base, ext = os.path.splitext(self.path)
+        records = []
+        for path in sorted(set(glob.glob(f'{base}-*{ext}')) | {self.path}):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        if records:
+            self._index_batch(index, records)
+
+    def _index_batch(self, index, batch):
+        rows = [
+            (
+                datetime.date.fromtimestamp(record['timestamp']).isoformat(),
+                record.get('video_id') or '',
+                record.get('title'),
+                record.get('bytes') or 0,
+            )
+            for record in batch if record.get('status', 'finished') == 'finished'
+        ]
+        index.executemany(
+            'INSERT INTO daily (day, video_id, title, downloads, bytes) VALUES (?, ?, ?, 1, ?) '
+            'ON CONFLICT (day, video_id) DO UPDATE SET '
+            'downloads = downloads + 1, bytes = bytes + excluded.bytes, title = excluded.title',
+            rows,
+        )
+        index.commit()
+
+    def _query(self, sql, params):
+        with closing(sqlite3.connect(self.index_path)) as index:
+            return index.execute(sql, params).fetchall()
+
+    def _since(self, days):
+        return (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
@@ -0,0 +1,399 @@
+import os
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import JobCancelled
+from transcode import NATIVE
+from metrics import stage_timer, observe_stage, BYTES_TOTAL, THROUGHPUT
+
+logger = logging.getLogger(__name__)
+
+
+def build_ydl_opts(download_dir, format_id, outtmpl='%(title)s.%(ext)s', fragments=1):
+    """
+    Builds the yt-dlp options for a single download. Audio conversion is
+    not part of it; see fetch_video() and AudioTranscoder.
+
+    Args:
+        download_dir (str): Directory the files are written to
+        format_id (str): yt-dlp format selector
+        outtmpl (str): Output filename template
+        fragments (int): Fragments of DASH/HLS formats fetched concurrently
+
+    Returns:
+        dict: Options for yt_dlp.YoutubeDL
+    """
+    ydl_opts = {
+        'paths': {'home': download_dir},
+        'format': format_id,
+        'outtmpl': outtmpl,
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'concurrent_fragment_downloads': max(1, fragments),
+    }
+    return ydl_opts
+
+
+def make_progress_hooks(job, playlist_index=None, playlist_count=None, extra=None, throttle=None):
+    """
+    Creates yt-dlp progress and postprocessor hooks that publish to a job.
+
+    Args:
+        job (Job): The job receiving progress snapshots
+        playlist_index (int): 1-based index of the entry, if part of a playlist
+        playlist_count (int): Number of entries in the playlist
+        extra (callable): Returns additional fields merged into each snapshot
+        throttle (callable): Takes the bytes received since the last call and
+            returns the seconds to pause, e.g. Lease.throttle
+
+    Returns:
+        tuple: (progress_hook, postprocessor_hook)
+    """
+    def snapshot(fields, info_dict):
+        fields['playlist_index'] = playlist_index or info_dict.get('playlist_index')
+        fields['playlist_count'] = playlist_count or info_dict.get('n_entries') or info_dict.get('playlist_count')
+        if extra:
+            fields.update(extra())
+        return fields
+
+    received = {}
+    received_lock = threading.Lock()
+
+    def download_hook(d):
+        # Abort the transfer as soon as the job is cancelled
+        if job.cancelled:
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled()
+
+        progress = snapshot({
+            'status': d['status'],
+            'downloaded_bytes': d.get('downloaded_bytes', 0),
+            'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+            'elapsed': d.get('elapsed', 0),
+            'eta': d.get('eta'),
+            'speed': d.get('speed'),
+            'filename': os.path.basename(d.get('filename', '')),
+        }, d.get('info_dict') or {})
+        if progress['total_bytes']:
+            progress['percent'] = round(100 * progress['downloaded_bytes'] / progress['total_bytes'], 1)
+
+        job.publish_progress(progress, force=d['status'] != 'downloading')
+
+        if throttle and d['status'] == 'downloading':
+            # Fragment threads report the running total per file
+            key = d.get('tmpfilename') or d.get('filename')
+            with received_lock:
+                delta = progress['downloaded_bytes'] - received.get(key, 0)
+                received[key] = max(progress['downloaded_bytes'], received.get(key, 0))
+            if delta > 0:
+                # Pausing here holds back the reads; wakes up early on cancel
+                job.cancel_event.wait(throttle(delta))
+
+        if d['status'] == 'finished':
+            size = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            BYTES_TOTAL.inc(size, direction='downloaded')
+            if d.get('elapsed'):
+                THROUGHPUT.observe(size / d['elapsed'])
+
+    postprocess_started = {}
+
+    def postprocessor_hook(d):
+        name = d.get('postprocessor')
+        if d['status'] == 'started':
+            postprocess_started[name] = time.monotonic()
+        elif d['status'] == 'finished' and name in postprocess_started:
+            observe_stage('postprocess', time.monotonic() - postprocess_started.pop(name), job.trace_id)
+
+        job.publish_progress(snapshot({
+            'status': 'postprocessing' if d['status'] != 'finished' else 'postprocessed',
+            'postprocessor': d.get('postprocessor'),
+        }, d.get('info_dict') or {}), force=True)
+
+    return download_hook, postprocessor_hook
+
+
+def downloaded_files(info):
+    """
+    Returns the final paths of the files yt-dlp wrote for one video, as
+    reported in 'requested_downloads' (updated in place by postprocessors).
+    """
+    paths = []
+    for download in info.get('requested_downloads') or [info]:
+        path = download.get('filepath')
+        if path and path not in paths and os.path.exists(path):
+            paths.append(path)
+    return paths
+
+
+def download_entry(job, url, ydl_opts):
+    """
+    Downloads a single video.
+
+    Returns:
+        tuple: (info dict, list of file paths)
+
+    Raises:
+        JobCancelled: If the job was cancelled during the download
+    """
+    import yt_dlp
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+    except yt_dlp.utils.DownloadCancelled:
+        raise JobCancelled(job.id)
+    return info, downloaded_files(info)
+
+
+def fetch_video(job, url, video_id, ydl_opts, media_cache=None, transcoder=None, audio_format=None,
+                slots=None, lease=None, pins=None):
+    """
+    Returns the files for one video, from the media cache when possible and
+    otherwise by downloading them and publishing the result to the cache.
+
+    Args:
+        job (Job): The owning job (progress and cancellation)
+        url (str): Video URL
+        video_id (str): Canonical video ID, or None if unknown (disables caching)
+        ydl_opts (dict): Options from build_ydl_opts()
+        media_cache (MediaCache): Cache to consult, or None
+        transcoder (AudioTranscoder): Converts the audio after the download
+        audio_format (str): Target audio format, or None/'native' to keep the download as is
+        slots (SlotPool): Global pool of concurrent yt-dlp downloads, or None
+        lease (Lease): The job's bandwidth share, taken only for the transfer, or None
+        pins (list): Collects the cache entries this call pinned; the caller
+            must release() each one once it no longer needs the files
+
+    Returns:
+        dict: {'id', 'title', 'files', 'cached'}
+    """
+    convert = transcoder is not None and audio_format not in (None, NATIVE)
+    digest = None
+    if media_cache and video_id:
+        postprocessors = [transcoder.settings(audio_format)] if convert else None
+        digest = media_cache.make_key(video_id, ydl_opts['format'], postprocessors)
+        if pins is not None:
+            # Pinned before lookup and publish, so no other publish evicts the entry under us
+            media_cache.acquire(digest)
+            pins.append(digest)
+        with stage_timer('media_cache_lookup', job.trace_id):
+            entry = media_cache.lookup(digest)
+        if entry:
+            # Cache hit: yt-dlp is not involved at all
+            return {'id': video_id, 'title': entry['title'], 'files': entry['files'], 'cached': True}
+
+    with stage_timer('download', job.trace_id):
+        if slots:
+            with slots.slot(priority=lease.slot_priority if lease else 0):
+                job.check_cancelled()
+                info, files = _transfer(job, url, ydl_opts, lease)
+        else:
+            info, files = _transfer(job, url, ydl_opts, lease)
+    if convert and files:
+        files = convert_audio(job, transcoder, files, audio_format, info, ydl_opts.get('postprocessor_hooks'))
+    title = info.get('title')
+    if digest and files:
+        with stage_timer('media_cache_publish', job.trace_id):
+            files = media_cache.publish(digest, files, title=title)
+    return {'id': info.get('id', video_id), 'title': title, 'files': files, 'cached': False}
+
+
+def _transfer(job, url, ydl_opts, lease=None):
+    """Runs download_entry() while holding the job's bandwidth share."""
+    if lease is None:
+        return download_entry(job, url, ydl_opts)
+    with lease.transfer():
+        return download_entry(job, url, ydl_opts)
+
+
+def convert_audio(job, transcoder, files, audio_format, info, hooks=None):
+    """
+    Runs the downloaded files through the transcoder, reporting progress
+    through the same hooks yt-dlp postprocessors use.
+
+    Returns:
+        list: The converted file paths
+    """
+    job.check_cancelled()
+    event = {'postprocessor': 'AudioTranscoder', 'info_dict': info}
+    for hook in hooks or []:
+        hook(dict(event, status='started'))
+    converted = [
+        transcoder.convert(path, audio_format, info.get('acodec'), job.trace_id)
+        for path in files
+    ]
+    for hook in hooks or []:
+        hook(dict(event, status='finished'))
+    return converted
+
+
+class PassthroughUnsupported(Exception):
+    """Raised when a format cannot be relayed as-is (merge, transcode or segmented protocol)."""
+
+
+class Passthrough:
+    """
+    An open upstream media stream for a single progressive format.
+
+    Attributes:
+        info (dict): yt-dlp info dict of the selected format
+        filename (str): Filename yt-dlp would have written
+        size (int): Content length in bytes, or None if unknown
+        response: yt-dlp networking response to read() from
+    """
+
+    def __init__(self, ydl, info, response):
+        self._ydl = ydl
+        self.info = info
+        self.response = response
+        self.filename = os.path.basename(ydl.prepare_filename(info))
+        self.size = int(response.headers.get('Content-Length') or 0) or None
+
+    def read(self, size):
+        return self.response.read(size)
+
+    def close(self):
+        try:
+            self.response.close()
+        finally:
+            self._ydl.close()
+
+
+def open_passthrough(url, format_id):
+    """
+    Resolves url to a single progressive format and opens its media stream
+    so the bytes can be relayed to a client while they arrive.
+
+    Args:
+        url (str): Video URL
+        format_id (str): yt-dlp format selector
+
+    Returns:
+        Passthrough: The open stream; the caller must close() it
+
+    Raises:
+        PassthroughUnsupported: If the format needs a merge or is not plain HTTP
+    """
+    import yt_dlp
+    from yt_dlp.networking import Request
+    ydl = yt_dlp.YoutubeDL({
+        'quiet': True,
+        'no_warnings': True,
+        'noplaylist': True,
+        'format': format_id,
+        'outtmpl': '%(title)s.%(ext)s',
+    })
+    try:
+        info = ydl.extract_info(url, download=False)
+        if (info.get('_type') == 'playlist' or info.get('requested_formats')
+                or info.get('protocol') not in ('http', 'https') or not info.get('url')):
+            raise PassthroughUnsupported(format_id)
+        response = ydl.urlopen(Request(info['url'], headers=info.get('http_headers')))
+    except Exception:
+        ydl.close()
+        raise
+    return Passthrough(ydl, info, response)
+
+
+def list_playlist(url):
+    """
+    Lists a playlist's entries without resolving them.
+
+    Returns:
+        tuple: (playlist title, list of flat entry dicts)
+    """
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'noplaylist': False,
+        'extract_flat': 'in_playlist',
+    }
+    import yt_dlp
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if 'entries' not in info:
+        # Not a playlist after all; treat it as a one-entry list
+        return info.get('title', 'Video'), [info]
+    return info.get('title', 'Playlist'), [entry for entry in info['entries'] or [] if entry]
+
+
+def download_playlist(job, url, download_dir, format_id, audio_format=None, parallelism=3,
+                      media_cache=None, transcoder=None, slots=None, lease=None, pins=None):
+    """
+    Downloads all entries of a playlist concurrently. A failing entry is
+    recorded in the results and does not abort the others.
+
+    Args:
+        job (Job): The owning job (progress and cancellation)
+        url (str): Playlist URL
+        download_dir (str): Directory the files are written to
+        format_id (str): yt-dlp format selector
+        audio_format (str): Target audio format for audio downloads, or None
+        parallelism (int): Maximum number of entries downloaded at once
+        media_cache (MediaCache): Cache for individual entries, or None
+        transcoder (AudioTranscoder): Converts the audio of each entry
+        slots (SlotPool): Global pool of concurrent yt-dlp downloads, or None
+        lease (Lease): The job's bandwidth share, shared by all entries, or None
+        pins (list): Collects the cache entries pinned for the entries (see fetch_video())
+
+    Returns:
+        tuple: (playlist title, list of per-entry result dicts)
+    """
+    title, entries = list_playlist(url)
+    total = len(entries)
+    done = [0]
+    done_lock = threading.Lock()
+
+    def progress_extra():
+        return {'entries_done': done[0]}
+
+    def run(index, entry):
+        result = {
+            'index': index,
+            'id': entry.get('id'),
+            'title': entry.get('title'),
+            'status': 'failed',
+            'files': [],
+            'error': None,
+        }
+        try:
+            job.check_cancelled()
+            # One directory per entry so equal titles cannot collide
+            ydl_opts = build_ydl_opts(os.path.join(download_dir, f'{index:03d}'), format_id,
+                                      fragments=lease.fragments if lease else 1)
+            hooks = make_progress_hooks(job, index, total, progress_extra,
+                                        throttle=lease.throttle if lease else None)
+            ydl_opts['progress_hooks'], ydl_opts['postprocessor_hooks'] = [hooks[0]], [hooks[1]]
+
+            video = fetch_video(job, entry.get('url') or entry.get('webpage_url'), entry.get('id'),
+                                ydl_opts, media_cache, transcoder, audio_format, slots, lease, pins)
+            files = video['files']
+            for path in files:
+                # Prefix with the playlist position to keep the archive ordered
+                job.add_output(path, f'{index:03d} - {os.path.basename(path)}')
+            result.update({
+                'title': video['title'] or result['title'],
+                'files': files,
+                'cached': video['cached'],
+                'status': 'finished' if files else 'failed',
+                'error': None if files else 'Keine Dateien gefunden',
+            })
+        except JobCancelled:
+            result['status'] = 'cancelled'
+        except Exception as e:
+            logger.error(f"Playlist entry {index} failed: {e}")
+            result['error'] = str(e)
+        with done_lock:
+            done[0] += 1
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix=f'playlist-{job.id[:8]}') as pool:
+        results = list(pool.map(lambda args: run(*args), enumerate(entries, start=1)))
+
+    job.check_cancelled()
+    return title, results
@@ -0,0 +1,167 @@
+import os
+import io
+import logging
+import hashlib
+import threading
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_NAME = 'youtube_downloader_cloudflare.zip'
+
+# Fixed timestamp for every archive member, so equal inputs give equal bytes
+ZIP_DATE_TIME = (2025, 1, 1, 0, 0, 0)
+
+ENV_EXAMPLE = """# Umgebungsvariablen für die Cloudflare-Bereitstellung
+SESSION_SECRET=ändere_mich_in_einen_sicheren_wert
+"""
+
+README = """# YouTube Downloader für Cloudflare
+
+## Anleitung zur Bereitstellung
+
+1. Entpacken Sie dieses ZIP-Archiv in ein Verzeichnis
+2. Erstellen Sie eine Datei `.env` basierend auf `.env.example` und setzen Sie alle erforderlichen Umgebungsvariablen
+3. Stellen Sie die Anwendung auf Cloudflare Workers bereit:
+   ```
+   wrangler deploy
+   ```
+
+## Anforderungen
+
+- Python 3.9 oder höher
+- yt-dlp
+- Flask
+- ffmpeg (für Audio-Konvertierung)
+
+## Hinweise
+
+Diese Anwendung ist als Demonstration gedacht. Bitte beachten Sie die Urheberrechte und Nutzungsbedingungen von YouTube.
+"""
+
+WRANGLER_CONFIG = """name = "youtube-downloader"
+main = "main.py"
+compatibility_date = "2025-03-20"
+
+[vars]
+# Setzen Sie Umgebungsvariablen in der Datei .env oder in der Cloudflare-Konsole
+
+[env.production]
+workers_dev = true
+"""
+
+# Files written into the bundle from the constants above
+GENERATED_FILES = (
+    ('.env.example', ENV_EXAMPLE),
+    ('README.md', README),
+    ('wrangler.toml', WRANGLER_CONFIG),
+)
+
+CONFIG_FILES = ('.replit', 'requirements.txt', 'pyproject.toml')
+
+
+class ExportBundle:
+    """
+    The Cloudflare deployment ZIP, built in memory once per source tree.
+
+    Each request only stats the input files. The archive is rebuilt when a
+    file was added, removed or modified, and its ETag is a hash of the
+    input contents, so touching a file without changing it keeps the ETag.
+
+    Args:
+        root (str): Application directory the bundle is built from
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._digest = None
+        self._data = None
+        self.builds = 0
+
+    def get(self):
+        """
+        Returns the current bundle, rebuilding it if an input changed.
+
+        Returns:
+            tuple: (ZIP bytes, content hash used as ETag)
+        """
+        files = self._inputs()
+        fingerprint = self._stat_fingerprint(files)
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                self._build(files, fingerprint)
+            return self._data, self._digest
+
+    def stats(self):
+        with self._lock:
+            return {
+                'builds': self.builds,
+                'etag': self._digest,
+                'bytes': len(self._data) if self._data else 0,
+            }
+
+    def _inputs(self):
+        # (path on disk, path in the archive), sorted for a stable hash
+        files = []
+        for name in os.listdir(self.root):
+            if name.endswith('.py'):
+                files.append((os.path.join(self.root, name), name))
+        templates = os.path.join(self.root, 'templates')
+        for name in os.listdir(templates):
+            files.append((os.path.join(templates, name), os.path.join('templates', name)))
+        static = os.path.join(self.root, 'static')
+        for dirpath, _, names in os.walk(static):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                files.append((path, os.path.relpath(path, self.root)))
+        for name in CONFIG_FILES:
+            path = os.path.join(self.root, name)
+            if os.path.exists(path):
+                files.append((path, name))
+        return sorted(files, key=lambda item: item[1])
+
+    @staticmethod
+    def _stat_fingerprint(files):
+        fingerprint = []
+        for path, zip_path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                fingerprint.append((zip_path, stat.st_size, stat.st_mtime_ns))
+        return tuple(fingerprint)
+
+    def _build(self, files, fingerprint):
+        # Caller must hold self._lock
+        members = []
+        for path, zip_path in files:
+            try:
+                with open(path, 'rb') as f:
+                    members.append((zip_path, f.read()))
+            except (IsADirectoryError, FileNotFoundError):
+                continue
+        members.extend((zip_path, content.encode('utf-8')) for zip_path, content in GENERATED_FILES)
+
+        digest = hashlib.sha256()
+        for zip_path, data in members:
+            digest.update(zip_path.encode('utf-8') + b'\0')
+            digest.update(hashlib.sha256(data).digest())
+        digest = digest.hexdigest()[:32]
+        self._fingerprint = fingerprint
+        if digest == self._digest:
+            return
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for zip_path, data in members:
+                info = zipfile.ZipInfo(zip_path.replace(os.sep, '/'), ZIP_DATE_TIME)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                zipf.writestr(info, data)
+        self._data = buffer.getvalue()
+        self._digest = digest
+        self.builds += 1
+        logger.info(f"Built export bundle {digest} ({len(self._data)} bytes from {len(members)} files)")
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Options shared by every metadata extraction; nothing is written to disk
+INFO_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': False,  # Allow playlists
+    # Only list playlists, without resolving their entries
+    'extract_flat': 'in_playlist',
+}
+
+# Extractors instantiated when a pooled instance is created
+WARM_EXTRACTORS = ('Youtube', 'YoutubeTab')
+
+
+class ExtractorPool:
+    """
+    Thread-safe pool of reusable YoutubeDL instances for info extraction.
+
+    Creating a YoutubeDL and instantiating its YouTube extractors costs more
+    than many cached lookups, so instances are kept and handed out one
+    caller at a time. An instance is discarded after max_uses extractions
+    or as soon as one fails, so state from a bad request never leaks into
+    the next one. Per-call options are applied as overrides and restored.
+
+    Args:
+        options (dict): YoutubeDL options for every instance
+        size (int): Idle instances kept
+        max_uses (int): Extractions before an instance is replaced
+    """
+
+    def __init__(self, options=None, size=4, max_uses=50):
+        self.options = dict(options or INFO_OPTIONS)
+        self.size = size
+        self.max_uses = max_uses
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+        self.failed = 0
+        self.setup_seconds = 0.0
+
+    @contextmanager
+    def extractor(self, **overrides):
+        """
+        Lends out one YoutubeDL instance for the enclosed block.
+
+        Args:
+            **overrides: Options that apply to this use only
+
+        Yields:
+            yt_dlp.YoutubeDL: An instance nobody else is using
+        """
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+            if entry:
+                self.reused += 1
+        if entry is None:
+            entry = self._create()
+
+        ydl = entry['ydl']
+        saved = {key: ydl.params.get(key) for key in overrides}
+        ydl.params.update(overrides)
+        try:
+            yield ydl
+        except Exception:
+            self.failed += 1
+            self._discard(entry)
+            raise
+        entry['uses'] += 1
+        ydl.params.update(saved)
+        if entry['uses'] >= self.max_uses:
+            self.recycled += 1
+            self._discard(entry)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(entry)
+                return
+        self._discard(entry)
+
+    def warm(self, count=None):
+        """Creates idle instances up to count (default: the pool size)."""
+        count = min(count or self.size, self.size)
+        while True:
+            with self._lock:
+                if len(self._idle) >= count:
+                    return
+            entry = self._create()
+            with self._lock:
+                if len(self._idle) >= self.size:
+                    break
+                self._idle.append(entry)
+        self._discard(entry)
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+        return {
+            'size': self.size,
+            'idle': idle,
+            'max_uses': self.max_uses,
+            'created': self.created,
+            'reused': self.reused,
+            'recycled': self.recycled,
+            'failed': self.failed,
+            'setup_seconds_avg': self.setup_seconds / self.created if self.created else 0.0,
+        }
+
+    def _create(self):
+        start = time.monotonic()
+        # Imported on first use; yt-dlp dominates the import time of the app
+        import yt_dlp
+        ydl = yt_dlp.YoutubeDL(dict(self.options))
+        for name in WARM_EXTRACTORS:
+            try:
+                ydl.get_info_extractor(name)
+            except Exception as e:
+                logger.debug(f"Could not warm extractor {name}: {e}")
+        seconds = time.monotonic() - start
+        observe_stage('extractor_setup', seconds)
+        with self._lock:
+            self.created += 1
+            self.setup_seconds += seconds
+        return {'ydl': ydl, 'uses': 0}
+
+    def _discard(self, entry):
+        try:
+            entry['ydl'].close()
+        except Exception as e:
+            logger.debug(f"Error closing extractor: {e}")
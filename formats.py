@@ -0,0 +1,195 @@
+from utils import get_available_formats
+
+# Bitrate of the MP3 files the audio postprocessor writes, in kbit/s
+MP3_BITRATE = 192
+
+# Native audio options: output format, source extensions, codec prefix
+NATIVE_AUDIO = (
+    ('m4a', ('m4a',), 'mp4a'),
+    ('opus', ('webm',), 'opus'),
+)
+
+# Audio codecs that can be muxed into each video container without re-encoding
+MERGE_COMPATIBLE = {
+    'mp4': ('m4a', 'mp4'),
+    'webm': ('webm',),
+}
+
+
+def _pick_audio(audio_formats, video_ext):
+    # Prefer an audio stream that fits the video container, so the merge
+    # stays a plain remux into mp4/webm instead of falling back to mkv
+    compatible = MERGE_COMPATIBLE.get(video_ext, ())
+    for fmt in audio_formats:
+        if fmt['ext'] in compatible:
+            return fmt, video_ext
+    if audio_formats:
+        return audio_formats[0], 'mkv'
+    return None, None
+
+
+def _sum_sizes(*formats):
+    sizes = [fmt['filesize'] for fmt in formats]
+    return sum(sizes) if all(sizes) else None
+
+
+def plan_formats(video_info):
+    """
+    Builds the ranked list of download plans for one video.
+
+    Each plan pairs concrete format IDs with a generic selector that yields
+    a comparable result for other videos (e.g. the rest of a playlist), and
+    records what it costs: the estimated size and whether yt-dlp has to
+    merge separate streams or transcode the audio.
+
+    Args:
+        video_info (dict): The video info dictionary from yt-dlp
+
+    Returns:
+        list: Plans ranked best first, each a dict with id, selector, type,
+            ext, height, fps, filesize_approx, merge and transcode (audio
+            plans also carry audio_format)
+    """
+    available = get_available_formats(video_info)
+    plans = []
+
+    for fmt in available['video']:
+        selector = f"best[height<={fmt['height']}]" if fmt['height'] else 'best'
+        plans.append({
+            'id': f"{fmt['format_id']}/{selector}",
+            'selector': selector,
+            'type': 'video',
+            'ext': fmt['ext'],
+            'height': fmt['height'],
+            'fps': fmt['fps'],
+            'filesize_approx': fmt['filesize'] or None,
+            'merge': False,
+            'transcode': False,
+        })
+
+    # One merge plan per resolution and container, keeping the smallest
+    merged = {}
+    for fmt in available['video_only']:
+        audio, ext = _pick_audio(available['audio'], fmt['ext'])
+        if not audio:
+            break
+        size = _sum_sizes(fmt, audio)
+        key = (fmt['height'], ext)
+        current = merged.get(key)
+        if current and (current['filesize_approx'] or float('inf')) <= (size or float('inf')):
+            continue
+        if ext == 'mkv':
+            video_filter, audio_filter = '', ''
+        else:
+            video_filter = f"[ext={fmt['ext']}]"
+            audio_filter = f"[ext={audio['ext']}]"
+        selector = f"bestvideo[height<={fmt['height']}]{video_filter}+bestaudio{audio_filter}/best[height<={fmt['height']}]"
+        merged[key] = {
+            'id': f"{fmt['format_id']}+{audio['format_id']}/{selector}",
+            'selector': selector,
+            'type': 'video',
+            'ext': ext,
+            'height': fmt['height'],
+            'fps': fmt['fps'],
+            'filesize_approx': size,
+            'merge': True,
+            'transcode': False,
+        }
+    plans.extend(merged.values())
+
+    if available['audio']:
+        # MP3 is always re-encoded at a fixed bitrate
+        duration = video_info.get('duration')
+        plans.append({
+            'id': f"{available['audio'][0]['format_id']}/bestaudio/best",
+            'selector': 'bestaudio/best',
+            'type': 'audio',
+            'ext': 'mp3',
+            'audio_format': 'mp3',
+            'height': None,
+            'fps': None,
+            'filesize_approx': int(duration * MP3_BITRATE * 1000 / 8) if duration else None,
+            'merge': False,
+            'transcode': True,
+        })
+
+    # Native audio: the best stream per codec family, kept without re-encoding
+    for audio_format, exts, codec in NATIVE_AUDIO:
+        source = next((fmt for fmt in available['audio'] if fmt['ext'] in exts), None)
+        if not source:
+            continue
+        selector = f"bestaudio[acodec^={codec}]/bestaudio/best"
+        plans.append({
+            'id': f"{source['format_id']}/{selector}",
+            'selector': selector,
+            'type': 'audio',
+            'ext': audio_format,
+            'audio_format': audio_format,
+            'height': None,
+            'fps': None,
+            'filesize_approx': source['filesize'] or None,
+            'merge': False,
+            'transcode': False,
+        })
+
+    return rank_plans(plans)
+
+
+def rank_plans(plans):
+    """
+    Sorts plans best first: higher resolution, then no merge, then no
+    transcode, then smaller estimated size.
+    """
+    return sorted(plans, key=lambda plan: (
+        -(plan['height'] or 0),
+        plan['merge'],
+        plan['transcode'],
+        plan['filesize_approx'] or float('inf'),
+    ))
+
+
+def choose_plan(plans, download_type='video', max_bytes=None, no_remux=False, min_height=None,
+                prefer_ext=None, no_transcode=False):
+    """
+    Picks a plan matching the given constraints.
+
+    Without min_height the best ranked plan that satisfies the constraints
+    wins. With min_height the cheapest plan that reaches it wins, so clients
+    can ask for "good enough" instead of "best".
+
+    Args:
+        plans (list): Plans from plan_formats()
+        download_type (str): 'video' or 'audio'
+        max_bytes (int): Upper bound for the estimated size; plans of
+            unknown size are skipped when set
+        no_remux (bool): Only accept plans that need no stream merge
+        min_height (int): Minimum video height
+        prefer_ext (str): Container to keep to when any qualifying plan has it
+        no_transcode (bool): Only accept plans that keep the audio as is
+
+    Returns:
+        dict: The chosen plan, or None if nothing qualifies
+    """
+    candidates = [plan for plan in plans if plan['type'] == download_type]
+    if no_remux:
+        candidates = [plan for plan in candidates if not plan['merge']]
+    if no_transcode:
+        candidates = [plan for plan in candidates if not plan['transcode']]
+    if max_bytes is not None:
+        candidates = [
+            plan for plan in candidates
+            if plan['filesize_approx'] and plan['filesize_approx'] <= max_bytes
+        ]
+    if min_height:
+        candidates = [plan for plan in candidates if (plan['height'] or 0) >= min_height]
+    if prefer_ext and any(plan['ext'] == prefer_ext for plan in candidates):
+        candidates = [plan for plan in candidates if plan['ext'] == prefer_ext]
+    if not candidates:
+        return None
+    if min_height:
+        return min(candidates, key=lambda plan: (
+            plan['filesize_approx'] or float('inf'),
+            plan['merge'],
+            plan['transcode'],
+        ))
+    return rank_plans(candidates)[0]
@@ -0,0 +1,474 @@
+import os
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from state import MemoryStateStore
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINAL_STATES = (FINISHED, FAILED, CANCELLED)
+
+# Minimum seconds between progress notifications sent to watchers
+PROGRESS_INTERVAL = 0.5
+
+# How often a job looks for a cancellation requested by another process,
+# and how long a view of another process's job is reused before re-reading it
+REMOTE_POLL_INTERVAL = 1.0
+REMOTE_REFRESH_INTERVAL = 0.25
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class ClientLimitExceeded(Exception):
+    """Raised when an owner already has as many unfinished jobs as allowed."""
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        self.owner = owner
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation has been requested."""
+
+
+class Job:
+    """
+    A single unit of background work tracked by the JobManager.
+
+    Args:
+        func (callable): Called as func(job, *args, **kwargs) by a worker
+        args (tuple): Positional arguments for func
+        kwargs (dict): Keyword arguments for func
+        trace_id (str): Trace ID of the request that created the job
+        owners (tuple): Keys of the clients the job counts against; the
+            first one is used for fair queuing
+    """
+
+    def __init__(self, func, args=(), kwargs=None, trace_id=None, owners=()):
+        self.id = uuid.uuid4().hex
+        self.trace_id = trace_id
+        self.owners = tuple(owners)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.progress = {}
+        self.progress_version = 0
+        self.outputs = []
+        self._progress_cond = threading.Condition()
+        self._last_notify = 0.0
+        # Set by the JobManager: persists the job, checks for remote cancellation
+        self._on_change = None
+        self._cancel_check = None
+        self._last_cancel_check = 0.0
+
+    @property
+    def cancelled(self):
+        if not self.cancel_event.is_set() and self._cancel_check:
+            now = time.monotonic()
+            if now - self._last_cancel_check >= REMOTE_POLL_INTERVAL:
+                self._last_cancel_check = now
+                if self._cancel_check():
+                    self.cancel_event.set()
+        return self.cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self.done_event.is_set()
+
+    def check_cancelled(self):
+        """
+        Raises JobCancelled if cancellation was requested. Long-running job
+        functions call this at safe points (e.g. from the yt-dlp progress hook).
+        """
+        if self.cancelled:
+            raise JobCancelled(self.id)
+
+    def publish_progress(self, progress, force=False):
+        """
+        Replaces the job's progress snapshot. Updates are coalesced: watchers
+        are woken at most every PROGRESS_INTERVAL seconds unless force is set
+        (used for phase changes), and always see only the latest snapshot.
+
+        Args:
+            progress (dict): The new progress snapshot
+            force (bool): Wake watchers immediately
+        """
+        with self._progress_cond:
+            self.progress = progress
+            self.progress_version += 1
+            now = time.monotonic()
+            notify = force or now - self._last_notify >= PROGRESS_INTERVAL
+            if notify:
+                self._last_notify = now
+                self._progress_cond.notify_all()
+        if notify and self._on_change:
+            self._on_change(self)
+
+    def wait_progress(self, last_version, timeout=None):
+        """
+        Blocks until a progress snapshot newer than last_version is available,
+        the job has finished or the timeout expires.
+
+        Returns:
+            tuple: (version, progress snapshot)
+        """
+        with self._progress_cond:
+            if self.progress_version == last_version and not self.done_event.is_set():
+                self._progress_cond.wait(timeout)
+            return self.progress_version, dict(self.progress)
+
+    def add_output(self, path, name=None):
+        """
+        Records a finished output file while the job is still running, so
+        consumers of iter_outputs() can start on it right away.
+
+        Args:
+            path (str): Location of the file
+            name (str): Name to present the file under (defaults to its basename)
+        """
+        with self._progress_cond:
+            self.outputs.append((path, name or os.path.basename(path)))
+            self._progress_cond.notify_all()
+        if self._on_change:
+            self._on_change(self)
+
+    def iter_outputs(self, timeout=15):
+        """
+        Yields (path, name) tuples for output files in the order they were
+        added, blocking for new ones until the job has finished.
+        """
+        index = 0
+        while True:
+            with self._progress_cond:
+                while index >= len(self.outputs) and not self.done_event.is_set():
+                    self._progress_cond.wait(timeout)
+                if index >= len(self.outputs):
+                    return
+                path = self.outputs[index]
+            index += 1
+            yield path
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    def to_record(self):
+        """Returns everything other processes need to report on and serve the job."""
+        with self._progress_cond:
+            return dict(
+                self.to_dict(),
+                trace_id=self.trace_id,
+                owners=list(self.owners),
+                result=self.result,
+                progress=self.progress,
+                progress_version=self.progress_version,
+                outputs=[list(output) for output in self.outputs],
+            )
+
+
+class RemoteJob:
+    """
+    Read-only view of a job running in another process, backed by its
+    record in the state store. Offers the parts of the Job interface that
+    status, result, event and ZIP requests use.
+    """
+
+    def __init__(self, record, store):
+        self._record = record
+        self._store = store
+        self._loaded_at = time.monotonic()
+        self.id = record['id']
+
+    def __getattr__(self, name):
+        if name in ('status', 'error', 'result', 'created_at', 'started_at', 'finished_at',
+                    'trace_id', 'progress', 'progress_version'):
+            return self._refresh().get(name)
+        raise AttributeError(name)
+
+    @property
+    def owners(self):
+        return tuple(self._refresh().get('owners') or ())
+
+    @property
+    def outputs(self):
+        return [tuple(output) for output in self._refresh().get('outputs') or []]
+
+    @property
+    def done(self):
+        return self.status in FINAL_STATES
+
+    @property
+    def cancelled(self):
+        return self.status == CANCELLED
+
+    def wait_progress(self, last_version, timeout=None):
+        deadline = time.monotonic() + (timeout or 0)
+        while self.progress_version == last_version and not self.done and time.monotonic() < deadline:
+            time.sleep(REMOTE_REFRESH_INTERVAL)
+        return self.progress_version, dict(self.progress or {})
+
+    def iter_outputs(self, timeout=15):
+        index = 0
+        while True:
+            outputs = self.outputs
+            if index < len(outputs):
+                yield outputs[index]
+                index += 1
+            elif self.done:
+                return
+            else:
+                time.sleep(REMOTE_REFRESH_INTERVAL)
+
+    def to_dict(self):
+        record = self._refresh()
+        return {key: record.get(key) for key in
+                ('id', 'status', 'error', 'created_at', 'started_at', 'finished_at')}
+
+    def _refresh(self):
+        if time.monotonic() - self._loaded_at >= REMOTE_REFRESH_INTERVAL:
+            record = self._store.get('jobs', self.id)
+            if record:
+                self._record = record
+            self._loaded_at = time.monotonic()
+        return self._record
+
+
+class JobManager:
+    """
+    Runs jobs on a fixed-size pool of worker threads fed by a bounded queue.
+
+    Submitting to a full queue fails immediately with JobQueueFull instead of
+    spawning more threads, so an overloaded node rejects work predictably.
+    Waiting jobs are queued per owner and workers take them round-robin
+    across owners, so one client submitting many jobs cannot starve the
+    others. Finished jobs are kept for result_ttl seconds so slow clients
+    can still collect their results.
+
+    Every job is also recorded in the state store, so with a shared store
+    any process can report on, cancel and serve jobs run by another one.
+    Queues, workers and per-owner limits stay local to each process.
+
+    Args:
+        workers (int): Number of worker threads
+        max_queue (int): Maximum number of jobs waiting for a worker
+        result_ttl (int): Seconds to keep finished jobs around
+        store (StateStore): Where job records are kept (default: in-process)
+    """
+
+    def __init__(self, workers=2, max_queue=32, result_ttl=3600, store=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.store = store or MemoryStateStore()
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._threads = []
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f'download-worker-{i}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, trace_id=None, owners=(), owner_limits=None, **kwargs):
+        """
+        Queues func for execution and returns the new Job.
+
+        Args:
+            func (callable): Called as func(job, *args, **kwargs)
+            trace_id (str): Trace ID of the submitting request
+            owners (tuple): Client keys the job counts against, e.g. IP and session
+            owner_limits (dict): Maximum unfinished jobs per owner key
+
+        Raises:
+            JobQueueFull: If max_queue jobs are already waiting
+            ClientLimitExceeded: If an owner is at its limit
+        """
+        self.start()
+        self._prune()
+        job = Job(func, args, kwargs, trace_id=trace_id, owners=owners)
+        with self._lock:
+            if self._queued >= self.max_queue:
+                raise JobQueueFull()
+            for owner, limit in (owner_limits or {}).items():
+                if self._unfinished(owner) >= limit:
+                    raise ClientLimitExceeded(owner)
+            self._jobs[job.id] = job
+            key = job.owners[0] if job.owners else None
+            self._queues.setdefault(key, deque()).append(job)
+            self._queued += 1
+            job._on_change = self._save
+            job._cancel_check = lambda: self.store.get('job_cancel', job.id)
+            self._save(job)
+            self._not_empty.notify()
+        return job
+
+    def get(self, job_id):
+        """Returns the Job, a RemoteJob if another process runs it, or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job:
+            return job
+        record = self.store.get('jobs', job_id)
+        return RemoteJob(record, self.store) if record else None
+
+    def cancel(self, job_id):
+        """
+        Requests cancellation of a job. Queued jobs are cancelled immediately,
+        running jobs stop at their next check_cancelled() call.
+
+        Returns:
+            Job: The job, or None if it does not exist
+        """
+        job = self.get(job_id)
+        if not job:
+            return None
+        if isinstance(job, RemoteJob):
+            # The owning process picks this up at its next cancellation check
+            if not job.done:
+                self.store.put('job_cancel', job_id, True, ttl=self.result_ttl)
+            return job
+        job.cancel_event.set()
+        with self._lock:
+            if job.status == QUEUED:
+                self._dequeue(job)
+                self._finish(job, CANCELLED)
+        return job
+
+    def queue_depth(self):
+        return self._queued
+
+    def unfinished_count(self, owner):
+        """Returns the number of queued or running jobs of an owner."""
+        with self._lock:
+            return self._unfinished(owner)
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == RUNNING)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                if job.status != QUEUED:
+                    # Cancelled while waiting
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+            self._save(job)
+            self._run(job)
+
+    def _next_job(self):
+        # Caller must hold self._lock. Takes the oldest job of the owner that
+        # has waited longest for its turn, then moves that owner to the back.
+        while not self._queued:
+            self._not_empty.wait()
+        owner, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        del self._queues[owner]
+        if jobs:
+            self._queues[owner] = jobs
+        self._queued -= 1
+        return job
+
+    def _dequeue(self, job):
+        # Caller must hold self._lock. Frees the queue place of a job that
+        # will not run, so it no longer counts towards max_queue.
+        key = job.owners[0] if job.owners else None
+        jobs = self._queues.get(key)
+        if jobs is None or job not in jobs:
+            return
+        jobs.remove(job)
+        if not jobs:
+            del self._queues[key]
+        self._queued -= 1
+
+    def _unfinished(self, owner):
+        # Caller must hold self._lock
+        return sum(
+            1 for job in self._jobs.values()
+            if owner in job.owners and job.status not in FINAL_STATES
+        )
+
+    def _run(self, job):
+        try:
+            result = job.func(job, *job.args, **job.kwargs)
+        except JobCancelled:
+            status, result, error = CANCELLED, None, None
+        except Exception as e:
+            if job.cancelled:
+                status, result, error = CANCELLED, None, None
+            else:
+                logger.error(f"Job {job.id} failed: {e}")
+                status, result, error = FAILED, None, str(e)
+        else:
+            status, error = FINISHED, None
+        with self._lock:
+            job.result = result
+            job.error = error
+            self._finish(job, status)
+
+    def _finish(self, job, status):
+        # Caller must hold self._lock
+        job.status = status
+        job.finished_at = time.time()
+        job.done_event.set()
+        with job._progress_cond:
+            job._progress_cond.notify_all()
+        self._save(job)
+
+    def _save(self, job):
+        try:
+            self.store.put('jobs', job.id, job.to_record(), ttl=self.result_ttl)
+        except Exception as e:
+            # The job itself goes on; only other processes lose sight of it
+            logger.error(f"Could not store job {job.id}: {e}")
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.status in FINAL_STATES and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        self.store.pop_expired('jobs')
+        self.store.pop_expired('job_cancel')
@@ -1,4 +1,78 @@
-from app import app
+import os
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startet den YouTube Downloader.')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 1)),
+                        help='Server processes (share jobs and tokens via STATE_STORE)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('ASGI_THREADS', 16)),
+                        help='Threads per process for views and response chunks')
+    parser.add_argument('--stream-threads', type=int, default=int(os.environ.get('ASGI_STREAM_THREADS', 32)),
+                        help='Responses per process that may wait on jobs or upstream servers (ZIP, batch, /stream)')
+    parser.add_argument('--download-workers', type=int, default=int(os.environ.get('DOWNLOAD_WORKERS', 2)),
+                        help='Concurrent download jobs per process')
+    parser.add_argument('--max-connections', type=int, default=int(os.environ.get('MAX_CONNECTIONS', 0)) or None,
+                        help='Reject connections beyond this many with 503 (default: unlimited)')
+    parser.add_argument('--backlog', type=int, default=int(os.environ.get('BACKLOG', 2048)))
+    parser.add_argument('--keep-alive', type=int, default=int(os.environ.get('KEEP_ALIVE', 5)),
+                        help='Seconds to keep idle connections open')
+    parser.add_argument('--no-prewarm', action='store_true', default=os.environ.get('PREWARM') == '0',
+                        help='Load yt-dlp and Pillow on first use instead of right after startup')
+    parser.add_argument('--profile-imports', action='store_true', default=os.environ.get('STARTUP_PROFILE') == '1',
+                        help='Record import time per module (see /stats/startup; single process only)')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='Import and start the app, print the startup report and exit')
+    parser.add_argument('--dev', action='store_true', help='Flask development server with debugger')
+    args = parser.parse_args()
+
+    # Read by app.py and asgi.py at import time
+    os.environ['WEB_WORKERS'] = str(args.workers)
+    os.environ['ASGI_THREADS'] = str(args.threads)
+    os.environ['ASGI_STREAM_THREADS'] = str(args.stream_threads)
+    os.environ['DOWNLOAD_WORKERS'] = str(args.download_workers)
+    os.environ['PREWARM'] = '0' if args.no_prewarm else '1'
+
+    import startup
+    if args.profile_imports or args.startup_report:
+        startup.report.profile_imports()
+
+    if args.startup_report:
+        # Same import path as the server, so import_app is measured too
+        import asgi
+        from app import start_services, prewarm
+        start_services()
+        if not args.no_prewarm:
+            prewarm()
+        print(startup.report.format())
+        return
+
+    if args.dev:
+        from app import app
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+
+    import uvicorn
+    if args.workers > 1 and os.environ.get('STATE_STORE', 'memory://').startswith('memory'):
+        logger.warning("Jobs and download tokens live in memory; with several workers set "
+                       "STATE_STORE=sqlite:///state.sqlite3 or route clients to the same process (sticky sessions)")
+    uvicorn.run(
+        'asgi:application',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        limit_concurrency=args.max_connections,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        proxy_headers=True,
+    )
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    logging.basicConfig(level=logging.INFO)
+    main()
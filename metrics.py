@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds, from cache hits to long downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels."""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    type = 'gauge'
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help = help_text
+        self.func = func
+
+    def samples(self):
+        try:
+            return [(self.name, (), self.func())]
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {e}")
+            return []
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._series.items():
+                for bound, count in zip(self.buckets, series['buckets']):
+                    samples.append((f'{self.name}_bucket', key + (('le', bound),), count))
+                samples.append((f'{self.name}_bucket', key + (('le', '+Inf'),), series['count']))
+                samples.append((f'{self.name}_sum', key, series['sum']))
+                samples.append((f'{self.name}_count', key, series['count']))
+        return samples
+
+
+class MetricsRegistry:
+    """Collects metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, func):
+        return self._register(Gauge(name, help_text, func))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'ytdl_stage_seconds', 'Time spent per request stage', ('stage',)
+)
+BYTES_TOTAL = registry.counter(
+    'ytdl_bytes_total', 'Bytes downloaded from upstream or sent to clients', ('direction',)
+)
+THROUGHPUT = registry.histogram(
+    'ytdl_download_bytes_per_second', 'Upstream download throughput per file',
+    buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6),
+)
+
+
+def observe_stage(stage, seconds, trace_id=None):
+    """Records a stage duration and logs it with the trace ID, if any."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if trace_id:
+        logger.info(f"[trace {trace_id}] {stage} took {seconds:.3f}s")
+
+
+@contextmanager
+def stage_timer(stage, trace_id=None):
+    """
+    Times the enclosed block as one stage.
+
+    Args:
+        stage (str): Stage name used as the histogram label
+        trace_id (str): Request trace ID to log with the timing
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.monotonic() - start, trace_id)
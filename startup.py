@@ -0,0 +1,161 @@
+"""
+Cold-start diagnostics: import time per module and named init phases.
+
+The import profiler is opt-in (python main.py --startup-report, or
+STARTUP_PROFILE=1) because it wraps every module loader; phases are always
+recorded and cost next to nothing.
+"""
+import sys
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+
+logger = logging.getLogger(__name__)
+
+
+class _TimedLoader:
+    """Delegates to the real loader and times exec_module()."""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profiler._stack()
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._profiler._record(module.__name__, elapsed, elapsed - children)
+
+
+class ImportProfiler(MetaPathFinder):
+    """
+    Records how long each module takes to import, including (cumulative)
+    and excluding (self) the modules it imports in turn.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._finding = threading.local()
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self._finding, 'active', False):
+            return None
+        self._finding.active = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._finding.active = False
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    def by_package(self):
+        """Self time summed per top-level package, slowest first."""
+        totals = {}
+        with self._lock:
+            for name, (_, own) in self.modules.items():
+                package = name.split('.', 1)[0]
+                totals[package] = totals.get(package, 0.0) + own
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name, cumulative, own):
+        with self._lock:
+            self.modules[name] = (cumulative, own)
+
+
+class StartupReport:
+    """Durations of named startup phases plus, if installed, the import profile."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def profile_imports(self):
+        """Installs the import profiler; call before importing the app."""
+        if self.profiler is None:
+            self.profiler = ImportProfiler().install()
+        return self.profiler
+
+    @contextmanager
+    def phase(self, name):
+        """Times the enclosed block as the startup phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = seconds
+        logger.info(f"Startup phase {name} took {seconds:.3f}s")
+
+    def as_dict(self, top=20):
+        with self._lock:
+            phases = dict(self.phases)
+        result = {
+            'uptime_seconds': round(time.perf_counter() - self.started, 3),
+            'phases': {name: round(seconds, 4) for name, seconds in phases.items()},
+        }
+        if self.profiler:
+            result['imports_by_package'] = {
+                package: round(seconds, 4) for package, seconds in self.profiler.by_package()[:top]
+            }
+        return result
+
+    def format(self, top=20):
+        """Human-readable report, slowest entries first."""
+        data = self.as_dict(top)
+        lines = ['Startup phases:']
+        for name, seconds in sorted(data['phases'].items(), key=lambda item: item[1], reverse=True):
+            lines.append(f'  {name:<32} {seconds * 1000:9.1f} ms')
+        if 'imports_by_package' in data:
+            lines.append('Import time by package (self time):')
+            for package, seconds in data['imports_by_package'].items():
+                lines.append(f'  {package:<32} {seconds * 1000:9.1f} ms')
+        return '\n'.join(lines)
+
+
+# Process-wide report, filled in by main.py, app.py and asgi.py
+report = StartupReport()
@@ -0,0 +1,207 @@
+import os
+import json
+import logging
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    Key-value store for state that every server process must see: jobs,
+    download tokens and the media cache index.
+
+    Values are JSON-serializable dicts grouped into namespaces and may
+    expire. Implementations must make put/delete/pop_expired atomic per
+    key; nothing else is assumed, so a networked store (e.g. one hash per
+    namespace plus an expiry index) fits the same interface.
+
+    Attributes:
+        shared (bool): Whether other processes see the same data
+    """
+
+    shared = False
+
+    def get(self, namespace, key):
+        """Returns the value stored under key, or None if missing or expired."""
+        raise NotImplementedError
+
+    def put(self, namespace, key, value, ttl=None):
+        """Stores value under key, replacing any previous one; ttl in seconds."""
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        """Removes key. Returns True if this call removed it."""
+        raise NotImplementedError
+
+    def scan(self, namespace):
+        """Returns all live (key, value) pairs of a namespace."""
+        raise NotImplementedError
+
+    def pop_expired(self, namespace):
+        """
+        Removes the expired entries of a namespace and returns them as
+        (key, value) pairs. Each entry is returned to exactly one caller,
+        so cleanup of what it refers to happens once.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """In-process store; values are copied in and out like a remote store would."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._data.get(namespace, {}).get(key)
+        if entry is None or _expired(entry[1]):
+            return None
+        return json.loads(entry[0])
+
+    def put(self, namespace, key, value, ttl=None):
+        encoded = json.dumps(value)
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = (encoded, _expires_at(ttl))
+
+    def delete(self, namespace, key):
+        with self._lock:
+            return self._data.get(namespace, {}).pop(key, None) is not None
+
+    def scan(self, namespace):
+        with self._lock:
+            entries = list(self._data.get(namespace, {}).items())
+        return [(key, json.loads(encoded)) for key, (encoded, expires_at) in entries if not _expired(expires_at)]
+
+    def pop_expired(self, namespace):
+        expired = []
+        with self._lock:
+            entries = self._data.get(namespace, {})
+            for key, (encoded, expires_at) in list(entries.items()):
+                if _expired(expires_at):
+                    del entries[key]
+                    expired.append((key, json.loads(encoded)))
+        return expired
+
+
+class SqliteStateStore(StateStore):
+    """
+    Store in one SQLite database, shared by every process that opens the
+    same file. SQLite's file locking serializes writers; WAL mode keeps
+    readers from blocking on them. Each thread uses its own connection.
+
+    Args:
+        path (str): Database file, created on first use
+        timeout (float): Seconds to wait for a lock held by another process
+    """
+
+    shared = True
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self, namespace, key):
+        row = self._connection().execute(
+            'SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (namespace, key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, namespace, key, value, ttl=None):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value), _expires_at(ttl)),
+            )
+
+    def delete(self, namespace, key):
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (namespace, key))
+        return cursor.rowcount > 0
+
+    def scan(self, namespace):
+        rows = self._connection().execute(
+            'SELECT key, value FROM state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (namespace, time.time()),
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def pop_expired(self, namespace):
+        connection = self._connection()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes
+        # sweeping at once cannot both see the same expired rows
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT key, value FROM state WHERE namespace = ? AND expires_at <= ?', (namespace, now)
+            ).fetchall()
+            connection.execute('DELETE FROM state WHERE namespace = ? AND expires_at <= ?', (namespace, now))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode; writes use explicit transactions
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, '
+                'PRIMARY KEY (namespace, key))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS state_expiry ON state (namespace, expires_at)')
+            self._local.connection = connection
+        return connection
+
+
+def open_state_store(url):
+    """
+    Opens the store named by url: 'memory://' (this process only) or
+    'sqlite:///path/to/state.sqlite3' (shared by all processes on the host,
+    or across hosts on a shared volume).
+
+    Raises:
+        ValueError: For unknown schemes
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryStateStore()
+    if parsed.scheme == 'sqlite':
+        # sqlite:///state.sqlite3 is relative, sqlite:////var/lib/... absolute
+        return SqliteStateStore(parsed.path[1:])
+    raise ValueError(f'Unknown state store: {url}')
+
+
+def _expires_at(ttl):
+    return time.time() + ttl if ttl is not None else None
+
+
+def _expired(expires_at):
+    return expires_at is not None and expires_at <= time.time()
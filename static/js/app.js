@@ -72,7 +72,7 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Set thumbnail
         const thumbnailImg = document.getElementById('video-thumbnail');
-        thumbnailImg.src = data.thumbnail;
+        thumbnailImg.src = data.thumbnail_url ? `${data.thumbnail_url}?w=640` : data.thumbnail;
         thumbnailImg.alt = data.title;
         
         // Display playlist info if it's a playlist
@@ -161,9 +161,8 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         }
         
-        // 2. Option: MP3 Audio in höchster Qualität
-        if (data.audio_formats && data.audio_formats.length > 0) {
-            const audioFormat = data.audio_formats[0]; // Wir nehmen einfach das erste Audio-Format
+        // 2. Option: MP3 Audio in höchster Qualität, danach ggf. Original-Audio ohne Umwandlung
+        (data.audio_formats || []).forEach(audioFormat => {
             
             const audioCol = document.createElement('div');
             audioCol.className = 'col-md-5 col-sm-12';
@@ -172,6 +171,7 @@ document.addEventListener('DOMContentLoaded', function() {
             audioCard.className = 'card format-option h-100';
             audioCard.dataset.formatId = audioFormat.id;
             audioCard.dataset.type = 'audio';
+            audioCard.dataset.audioFormat = audioFormat.audio_format || 'mp3';
             
             const audioCardBody = document.createElement('div');
             audioCardBody.className = 'card-body text-center';
@@ -182,11 +182,11 @@ document.addEventListener('DOMContentLoaded', function() {
             
             const audioTitle = document.createElement('h4');
             audioTitle.className = 'card-title';
-            audioTitle.textContent = 'MP3 Audio';
+            audioTitle.textContent = `${(audioFormat.ext || 'mp3').toUpperCase()} Audio`;
             
             const audioDesc = document.createElement('p');
             audioDesc.className = 'card-text';
-            audioDesc.textContent = 'Beste Audioqualität';
+            audioDesc.textContent = audioFormat.note || 'Beste Audioqualität';
             
             // Zeige Dateigröße wenn verfügbar
             const fileSizeInfo = document.createElement('p');
@@ -218,7 +218,7 @@ document.addEventListener('DOMContentLoaded', function() {
             audioCard.addEventListener('click', function() {
                 selectFormat(this);
             });
-        }
+        });
         
         formatContainer.appendChild(optionsRow);
         
@@ -257,7 +257,8 @@ document.addEventListener('DOMContentLoaded', function() {
             startDownload(
                 selectedFormat.dataset.formatId, 
                 selectedFormat.dataset.type,
-                currentVideoInfo.is_playlist
+                currentVideoInfo.is_playlist,
+                selectedFormat.dataset.audioFormat
             );
         });
     }
@@ -277,7 +278,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Start download
-    function startDownload(formatId, type, isPlaylist) {
+    function startDownload(formatId, type, isPlaylist, audioFormat) {
         // Show progress
         formatContainer.style.display = 'none';
         progressContainer.style.display = 'block';
@@ -305,6 +306,9 @@ document.addEventListener('DOMContentLoaded', function() {
         formData.append('format', formatId);
         formData.append('type', type);
         formData.append('is_playlist', isPlaylist);
+        if (audioFormat) {
+            formData.append('audio_format', audioFormat);
+        }
         
         // Start download
         fetch('/download', {
@@ -320,16 +324,11 @@ document.addEventListener('DOMContentLoaded', function() {
             return response.json();
         })
         .then(data => {
-            // Angepasste Simulation basierend auf Playlist oder einzelnes Video
-            if (isPlaylist) {
-                simulatePlaylistProgress(currentVideoInfo.video_count || 5, () => {
-                    completeDownload(data);
-                });
-            } else {
-                simulateProgress(() => {
-                    completeDownload(data);
-                });
-            }
+            // Der Server liefert sofort eine Auftrags-ID; der Fortschritt kommt per SSE
+            return watchJob(data);
+        })
+        .then(result => {
+            completeDownload(result);
         })
         .catch(error => {
             progressContainer.style.display = 'none';
@@ -337,6 +336,38 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Follow the job's progress stream and resolve with the download result
+    function watchJob(job) {
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(job.events_url);
+            
+            events.addEventListener('progress', e => {
+                updateProgress(JSON.parse(e.data));
+            });
+            
+            events.addEventListener('done', () => {
+                events.close();
+                setProgress(100);
+                
+                fetch(job.result_url)
+                .then(response => response.json().then(data => {
+                    if (!response.ok) {
+                        throw new Error(data.error || 'Download failed');
+                    }
+                    resolve(data);
+                }))
+                .catch(reject);
+            });
+            
+            events.onerror = () => {
+                // EventSource reconnects on its own; only give up if it was closed
+                if (events.readyState === EventSource.CLOSED) {
+                    reject(new Error('Verbindung zum Server verloren'));
+                }
+            };
+        });
+    }
+    
     // Komplettes Download-Ergebnis anzeigen
     function completeDownload(data) {
         // When complete, show download link
@@ -364,57 +395,42 @@ document.addEventListener('DOMContentLoaded', function() {
         downloadContainer.appendChild(fileInfo);
     }
     
-    // Simulate progress (in a real app, you would use WebSockets or Server-Sent Events)
-    function simulateProgress(callback) {
-        let progress = 0;
-        const interval = setInterval(() => {
-            progress += Math.floor(Math.random() * 10) + 1;
-            if (progress >= 100) {
-                progress = 100;
-                clearInterval(interval);
-                
-                if (callback) {
-                    setTimeout(callback, 500);
-                }
-            }
-            
-            progressBar.style.width = `${progress}%`;
-            progressBar.setAttribute('aria-valuenow', progress);
-            progressBar.textContent = `${progress}%`;
-        }, 300);
+    // Render a progress event from the server
+    function updateProgress(progress) {
+        const playlistProgressEl = document.getElementById('playlist-progress');
+        const count = progress.playlist_count;
+        // Einträge werden parallel geladen; abgeschlossene Einträge zählen voll
+        const done = progress.entries_done !== undefined ? progress.entries_done : (progress.playlist_index || 1) - 1;
+        
+        if (playlistProgressEl && count) {
+            playlistProgressEl.textContent = `(${done}/${count})`;
+        }
+        
+        let percent = progress.percent || 0;
+        if (count) {
+            // Gesamtfortschritt über alle Playlist-Einträge
+            percent = Math.min((done * 100 + percent) / count, 100);
+        }
+        
+        if (progress.status === 'postprocessing') {
+            progressBar.textContent = 'Wird konvertiert...';
+            return;
+        }
+        setProgress(Math.round(percent), progress);
     }
     
-    // Simulate playlist progress
-    function simulatePlaylistProgress(videoCount, callback) {
-        let currentVideo = 0;
-        let totalProgress = 0;
-        
-        const updateProgress = () => {
-            currentVideo++;
-            const playlistProgressEl = document.getElementById('playlist-progress');
-            if (playlistProgressEl) {
-                playlistProgressEl.textContent = `(${currentVideo}/${videoCount})`;
-            }
-            
-            totalProgress = Math.min(Math.round((currentVideo / videoCount) * 100), 100);
-            progressBar.style.width = `${totalProgress}%`;
-            progressBar.setAttribute('aria-valuenow', totalProgress);
-            progressBar.textContent = `${totalProgress}%`;
-            
-            if (currentVideo >= videoCount) {
-                if (callback) {
-                    setTimeout(callback, 500);
-                }
-                return;
-            }
-            
-            // Zufällige Zeit für den "Download" des nächsten Videos
-            const nextVideoTime = 500 + Math.random() * 2000;
-            setTimeout(updateProgress, nextVideoTime);
-        };
+    function setProgress(percent, progress) {
+        progressBar.style.width = `${percent}%`;
+        progressBar.setAttribute('aria-valuenow', percent);
         
-        // Starte mit dem ersten Video
-        setTimeout(updateProgress, 800);
+        let label = `${percent}%`;
+        if (progress && progress.speed) {
+            label += ` · ${(progress.speed / (1024 * 1024)).toFixed(1)} MB/s`;
+        }
+        if (progress && progress.eta) {
+            label += ` · ${progress.eta}s`;
+        }
+        progressBar.textContent = label;
     }
     
     // Show error message
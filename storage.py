@@ -0,0 +1,182 @@
+import os
+import logging
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStorage(Exception):
+    """Raised when there is not enough disk space to accept new work."""
+
+
+def directory_stats(path):
+    """
+    Returns (total size in bytes, newest modification time) for a file or
+    directory tree. Directory mtimes alone miss files that are still growing.
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
+    size = 0
+    newest = os.path.getmtime(path)
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            newest = max(newest, stat.st_mtime)
+    return size, newest
+
+
+class StorageJanitor:
+    """
+    Single background thread that keeps the downloads directory in check.
+
+    On every sweep it runs the registered callbacks (e.g. expiring download
+    tokens), removes top-level entries whose TTL has passed since they were
+    last written to, and evicts the oldest unused entries while the
+    directory exceeds its quota. At startup, entries that no one has
+    touched for orphan_age seconds are reclaimed.
+
+    Args:
+        root (str): Directory to manage
+        quota_bytes (int): Maximum total size of root
+        min_free_bytes (int): Free disk space required to accept new jobs
+        ttls (dict): Maps entry name prefixes to TTLs in seconds
+        default_ttl (int): TTL for entries matching no prefix
+        orphan_age (int): Minimum idle seconds before startup reclaims an entry
+        interval (int): Seconds between sweeps
+        in_use (callable): Returns True for paths that must not be removed
+    """
+
+    def __init__(self, root='downloads', quota_bytes=20 * 1024 ** 3, min_free_bytes=1024 ** 3,
+                 ttls=None, default_ttl=7200, orphan_age=600, interval=60, in_use=None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.orphan_age = orphan_age
+        self.interval = interval
+        self.in_use = in_use or (lambda path: False)
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self.used_bytes = 0
+        self.reclaimed_bytes = 0
+        self.reclaimed_entries = 0
+        self.last_sweep = None
+
+    def add_callback(self, callback):
+        """Registers a callable that runs at the start of every sweep."""
+        self._callbacks.append(callback)
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            self.reclaim_orphans()
+            self._thread = threading.Thread(target=self._run, name='storage-janitor', daemon=True)
+            self._thread.start()
+
+    def reclaim_orphans(self):
+        """Removes entries left behind by earlier processes (failed or abandoned downloads)."""
+        now = time.time()
+        for name, path, size, mtime in self._entries():
+            if now - mtime >= self.orphan_age and not self.in_use(path):
+                logger.info(f"Reclaiming orphaned download {path}")
+                self._remove(path, size)
+
+    def sweep(self):
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Janitor callback failed: {e}")
+
+        now = time.time()
+        remaining = []
+        for name, path, size, mtime in self._entries():
+            if self.in_use(path):
+                remaining.append((mtime, path, size, True))
+                continue
+            if now - mtime > self._ttl_for(name):
+                self._remove(path, size)
+            else:
+                remaining.append((mtime, path, size, False))
+
+        # Enforce the quota, oldest unused entries first
+        used = sum(size for _, _, size, _ in remaining)
+        for mtime, path, size, busy in sorted(remaining):
+            if used <= self.quota_bytes:
+                break
+            if busy:
+                continue
+            self._remove(path, size)
+            used -= size
+        self.used_bytes = used
+        self.last_sweep = now
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def check_space(self):
+        """
+        Raises InsufficientStorage when the disk is nearly full or the
+        quota is exhausted, so callers can refuse new jobs up front.
+        """
+        if self.free_bytes() < self.min_free_bytes:
+            raise InsufficientStorage('free space below minimum')
+        if self.used_bytes >= self.quota_bytes:
+            raise InsufficientStorage('download quota exhausted')
+
+    def stats(self):
+        return {
+            'free_bytes': self.free_bytes(),
+            'used_bytes': self.used_bytes,
+            'quota_bytes': self.quota_bytes,
+            'min_free_bytes': self.min_free_bytes,
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'reclaimed_entries': self.reclaimed_entries,
+            'last_sweep': self.last_sweep,
+        }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Storage sweep failed: {e}")
+
+    def _entries(self):
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                size, mtime = directory_stats(path)
+            except OSError:
+                continue
+            yield name, path, size, mtime
+
+    def _ttl_for(self, name):
+        for prefix, ttl in self.ttls.items():
+            if name.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def _remove(self, path, size):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"Error removing {path}: {e}")
+            return
+        self.reclaimed_bytes += size
+        self.reclaimed_entries += 1
@@ -0,0 +1,161 @@
+import os
+import json
+import logging
+import zipfile
+from werkzeug.wsgi import ClosingIterator
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from disk per chunk when streaming files
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds between comments that keep idle event streams (and proxies) alive
+SSE_KEEPALIVE_INTERVAL = 15
+SSE_KEEPALIVE = ": keepalive\n\n"
+
+
+# WSGI environ flag set by blocking_body()
+BLOCKING_BODY = 'ytdl.blocking_body'
+
+
+def blocking_body(response, environ):
+    """
+    Marks a response whose body may block for a long time between chunks,
+    e.g. while waiting for job outputs, extractions or upstream reads. The
+    ASGI bridge pulls such bodies on their own thread pool so they cannot
+    take the threads that run views.
+
+    Args:
+        response (Response): The streaming response
+        environ (dict): WSGI environ of the current request
+    """
+    environ[BLOCKING_BODY] = True
+    return response
+
+
+def sse_event(event, data):
+    """Formats one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def call_after_send(response, callback):
+    """
+    Runs callback once the response body has been sent or discarded.
+
+    Response.call_on_close() is not enough for send_file() responses:
+    direct-passthrough bodies are handed to the server without the closing
+    wrapper, so their close callbacks never fire.
+
+    Args:
+        response (Response): The response to watch
+        callback (callable): Called without arguments
+    """
+    response.response = ClosingIterator(response.response, callback)
+    return response
+
+
+class _ChunkWriter:
+    """
+    Minimal write-only file object that collects what zipfile writes so it
+    can be handed out in chunks. It cannot seek, which makes zipfile emit
+    data descriptors instead of rewriting local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def tee_stream(source, sink_path=None, expected_size=None, on_complete=None, chunk_size=CHUNK_SIZE):
+    """
+    Relays a readable stream chunk by chunk, optionally writing a copy to
+    sink_path. The copy is handed to on_complete only if the whole stream
+    was received; otherwise (e.g. the client went away) it is deleted.
+
+    Args:
+        source: Object with read(size) and close()
+        sink_path (str): File to write the copy to, or None
+        expected_size (int): Expected total bytes, or None if unknown
+        on_complete (callable): Called with sink_path after a complete copy
+        chunk_size (int): Bytes read per chunk
+
+    Yields:
+        bytes: The stream's data
+    """
+    sink = open(sink_path, 'wb') if sink_path else None
+    received = 0
+    complete = False
+    try:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            if sink:
+                sink.write(chunk)
+            received += len(chunk)
+            yield chunk
+        complete = expected_size is None or received == expected_size
+    finally:
+        source.close()
+        if sink:
+            sink.close()
+            if complete and on_complete:
+                try:
+                    on_complete(sink_path)
+                except Exception as e:
+                    logger.error(f"Error storing streamed copy {sink_path}: {e}")
+            elif os.path.exists(sink_path):
+                os.remove(sink_path)
+
+
+def stream_zip(files, chunk_size=CHUNK_SIZE):
+    """
+    Generates a ZIP archive on the fly without staging it on disk.
+
+    Entries are written in STORED mode since audio and video are already
+    compressed. Files are consumed lazily from the iterable, so the first
+    bytes go out as soon as the first file is available even if later ones
+    are still being produced.
+
+    Args:
+        files (iterable): Yields (source path, name in archive) tuples
+        chunk_size (int): Bytes read per chunk
+
+    Yields:
+        bytes: Consecutive pieces of the ZIP archive
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+        for source_path, zip_path in files:
+            if not os.path.exists(source_path):
+                logger.warning(f"Skipping missing ZIP entry {source_path}")
+                continue
+            zinfo = zipfile.ZipInfo.from_file(source_path, zip_path)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(source_path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield from _drain(writer)
+            yield from _drain(writer)
+    # Central directory
+    yield from _drain(writer)
+
+
+def _drain(writer):
+    data = writer.drain()
+    if data:
+        yield data
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+# Size of every synthetic media file served to the fake yt-dlp
+MEDIA_SIZE = 64 * 1024
+
+
+@pytest.fixture(scope='session')
+def media_server():
+    from media_server import MediaServer
+    import fake_ytdlp
+
+    server = MediaServer(size=MEDIA_SIZE).start()
+    fake_ytdlp.install(server)
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def app_module(media_server, tmp_path_factory):
+    """The app, working in a temporary directory and downloading through the fake yt-dlp."""
+    os.chdir(tmp_path_factory.mktemp('app'))
+    os.environ.setdefault('PREWARM', '0')
+    import app
+    app.media_cache.open()
+    return app
@@ -0,0 +1,21 @@
+import os
+import time
+
+from conftest import MEDIA_SIZE
+from jobs import Job
+from fake_ytdlp import bench_playlist_id, playlist_url
+
+
+def test_playlist_larger_than_media_cache(app_module, monkeypatch):
+    # Room for two and a half entries; later publishes evict earlier ones
+    monkeypatch.setattr(app_module.media_cache, 'max_bytes', MEDIA_SIZE * 5 // 2)
+    job = Job(app_module.perform_download)
+    job.started_at = time.time()
+
+    result = app_module.perform_download(job, playlist_url(bench_playlist_id(1, 6)), 'best', 'video', True,
+                                         {'ip': '127.0.0.1', 'user_agent': 'pytest'})
+
+    assert [entry['status'] for entry in result['entries']] == ['finished'] * 6
+    # Issued tokens keep every file around, however far over budget the cache is
+    assert all(os.path.exists(path) for path in result['files'])
+    assert app_module.media_cache.stats()['pinned'] == 0
@@ -0,0 +1,29 @@
+import threading
+
+import pytest
+
+from jobs import CANCELLED, JobManager, JobQueueFull
+
+
+def test_cancelled_jobs_free_their_queue_place():
+    started, release = threading.Event(), threading.Event()
+    manager = JobManager(workers=1, max_queue=3)
+    # Keeps the only worker busy so everything else stays queued
+    manager.submit(lambda job: started.set() or release.wait(5))
+    assert started.wait(5)
+    try:
+        queued = [manager.submit(lambda job: None, owners=(owner,)) for owner in ('a', 'a', 'b')]
+        with pytest.raises(JobQueueFull):
+            manager.submit(lambda job: None)
+
+        for job in queued:
+            manager.cancel(job.id)
+        assert all(job.status == CANCELLED for job in queued)
+        assert manager.queue_depth() == 0
+
+        jobs = [manager.submit(lambda job: None) for _ in range(3)]
+        assert manager.queue_depth() == 3
+    finally:
+        release.set()
+    for job in jobs:
+        assert job.done_event.wait(5)
@@ -0,0 +1,205 @@
+import os
+import io
+import logging
+import hashlib
+import threading
+import urllib.request
+import uuid
+from urllib.parse import urlparse
+
+from cache import MetadataCache
+
+logger = logging.getLogger(__name__)
+
+# Widths variants are rendered at; requests are rounded up to the next one
+WIDTHS = (120, 240, 320, 480, 640, 1280)
+
+# Pillow format name, file extension and save options per output format
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+class ThumbnailNotFound(Exception):
+    """Raised when no thumbnail could be fetched for a video."""
+
+
+class ThumbnailCache:
+    """
+    Fetches each video's thumbnail from upstream once and serves resized
+    WebP/JPEG variants of it.
+
+    Sources and rendered variants are stored on disk under root/<video id>/
+    and the most recently used variants are also kept in memory. When the
+    directory grows beyond max_bytes, the least recently used videos are
+    removed. Concurrent requests for the same variant share one render.
+
+    Args:
+        root (str): Cache directory
+        max_bytes (int): Disk budget in bytes
+        memory_entries (int): Variants kept in memory
+        timeout (float): Seconds to wait for upstream
+    """
+
+    SOURCE_FILE = 'source'
+
+    def __init__(self, root='cache/thumbs', max_bytes=256 * 1024 ** 2, memory_entries=512, timeout=10):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._memory = MetadataCache(max_entries=memory_entries, ttl=24 * 3600)
+        # Videos without a thumbnail are not retried upstream for a while
+        self._missing = MetadataCache(max_entries=memory_entries, ttl=600)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.upstream_fetches = 0
+        self.renders = 0
+        self._opened = False
+
+    def open(self):
+        """Creates the cache directory and measures what is already in it; idempotent."""
+        with self._lock:
+            if self._opened:
+                return
+            self._opened = True
+        os.makedirs(self.root, exist_ok=True)
+        total = sum(size for _, _, size in self._entries())
+        with self._lock:
+            self.total_bytes += total
+
+    @staticmethod
+    def variant_width(width):
+        """Rounds a requested width up to the next rendered width."""
+        for candidate in WIDTHS:
+            if width <= candidate:
+                return candidate
+        return WIDTHS[-1]
+
+    def get(self, video_id, width, fmt, source_url=None):
+        """
+        Returns one rendered variant.
+
+        Args:
+            video_id (str): Canonical video ID (validated by the caller)
+            width (int): Width from WIDTHS
+            fmt (str): 'webp' or 'jpeg'
+            source_url (str): Thumbnail URL from the video info, if known
+
+        Returns:
+            tuple: (image bytes, ETag value)
+
+        Raises:
+            ThumbnailNotFound: If upstream has no thumbnail for the video
+        """
+        return self._memory.get_or_load(
+            f'{video_id}:{width}:{fmt}',
+            lambda: self._load_variant(video_id, width, fmt, source_url),
+        )
+
+    def stats(self):
+        return {
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'upstream_fetches': self.upstream_fetches,
+            'renders': self.renders,
+            'memory': self._memory.stats(),
+        }
+
+    def _load_variant(self, video_id, width, fmt, source_url):
+        pil_format, ext, options = FORMATS[fmt]
+        path = os.path.join(self.root, video_id, f'{width}.{ext}')
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(os.path.dirname(path))
+        except FileNotFoundError:
+            source = self._memory.get_or_load(f'{video_id}:source', lambda: self._load_source(video_id, source_url))
+            from PIL import Image
+            image = Image.open(io.BytesIO(source[0]))
+            image.thumbnail((width, width * 3))
+            if image.mode not in ('RGB', 'RGBA') or pil_format == 'JPEG':
+                image = image.convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, pil_format, **options)
+            data = buffer.getvalue()
+            self.renders += 1
+            self._write(path, data)
+        return data, hashlib.sha1(data).hexdigest()[:20]
+
+    def _load_source(self, video_id, source_url):
+        path = os.path.join(self.root, video_id, self.SOURCE_FILE)
+        try:
+            with open(path, 'rb') as f:
+                return f.read(), None
+        except FileNotFoundError:
+            pass
+        if self._missing.get(video_id):
+            raise ThumbnailNotFound(video_id)
+        for url in self._source_candidates(video_id, source_url):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    data = response.read()
+            except Exception as e:
+                logger.info(f"Thumbnail {url} unavailable: {e}")
+                continue
+            self.upstream_fetches += 1
+            self._write(path, data)
+            return data, None
+        self._missing.put(video_id, True)
+        raise ThumbnailNotFound(video_id)
+
+    def _source_candidates(self, video_id, source_url):
+        # Only ever fetch from YouTube's image hosts
+        if source_url and (urlparse(source_url).hostname or '').endswith('.ytimg.com'):
+            yield source_url
+        for name in ('maxresdefault.jpg', 'hqdefault.jpg'):
+            yield f'https://i.ytimg.com/vi/{video_id}/{name}'
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.total_bytes += len(data)
+            over_budget = self.total_bytes > self.max_bytes
+        if over_budget:
+            self._evict(keep=os.path.basename(os.path.dirname(path)))
+
+    def _entries(self):
+        # (mtime, video directory, size) for every cached video
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            size = 0
+            for item in os.scandir(entry.path):
+                try:
+                    size += item.stat().st_size
+                except OSError:
+                    pass
+            yield entry.stat().st_mtime, entry.path, size
+
+    def _evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if os.path.basename(path) == keep:
+                continue
+            for item in os.scandir(path):
+                try:
+                    os.remove(item.path)
+                except OSError:
+                    pass
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self.total_bytes = total
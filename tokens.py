@@ -0,0 +1,113 @@
+import os
+import logging
+import shutil
+import time
+import uuid
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from state import MemoryStateStore
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadTokens:
+    """
+    Issues signed, expiring tokens that each map to one result file.
+
+    A user can hold any number of tokens at once, and a token can be used
+    repeatedly until it expires, so interrupted transfers can be resumed
+    with Range requests. Files are cleaned up when the last token that
+    references them expires, not when the first response closes. Media
+    cache entries count as pinned for as long as a token points at them
+    (see pinned_digests()).
+
+    Token entries live in the state store, so with a shared store a token
+    issued by one process resolves in every other.
+
+    Args:
+        secret_key (str): Key used to sign tokens
+        ttl (int): Seconds a token stays valid
+        media_cache (MediaCache): Cache whose entries tokens may point into, or None
+        downloads_dir (str): Files below this directory are deleted on expiry
+        store (StateStore): Where token entries are kept (default: in-process)
+    """
+
+    def __init__(self, secret_key, ttl=3600, media_cache=None, downloads_dir='downloads', store=None):
+        self.ttl = ttl
+        self.media_cache = media_cache
+        self.downloads_dir = os.path.abspath(downloads_dir)
+        self.store = store or MemoryStateStore()
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='download-token')
+
+    def issue(self, path, filename):
+        """
+        Creates a token for path.
+
+        Args:
+            path (str): The file the token grants access to
+            filename (str): Name offered to the client
+
+        Returns:
+            str: The signed token
+        """
+        self.sweep()
+        token_id = uuid.uuid4().hex
+        path = os.path.abspath(path)
+        self.store.put('tokens', token_id, {
+            'path': path,
+            'filename': filename,
+            'digest': self.media_cache.digest_for_path(path) if self.media_cache else None,
+            'expires_at': time.time() + self.ttl,
+        }, ttl=self.ttl)
+        return self._serializer.dumps(token_id)
+
+    def resolve(self, token):
+        """
+        Returns the entry for a token, or None if it is invalid or expired.
+
+        Returns:
+            dict: {'path', 'filename', 'digest', 'expires_at'}
+        """
+        try:
+            token_id = self._serializer.loads(token, max_age=self.ttl)
+        except (SignatureExpired, BadSignature):
+            return None
+        return self.store.get('tokens', token_id)
+
+    def sweep(self):
+        """Drops expired tokens and removes files no longer referenced by any token."""
+        expired = self.store.pop_expired('tokens')
+        if not expired:
+            return 0
+        live = self.referenced_paths()
+        # Files inside the media cache are left to its own eviction
+        for path in {entry['path'] for _, entry in expired if not entry['digest']} - live:
+            self._remove(path)
+        return len(expired)
+
+    def referenced_paths(self):
+        """Returns the absolute paths of all files that live tokens point at."""
+        return {entry['path'] for _, entry in self.store.scan('tokens')}
+
+    def pinned_digests(self):
+        """Returns the media cache entries that live tokens point into."""
+        return {entry['digest'] for _, entry in self.store.scan('tokens') if entry['digest']}
+
+    def active_count(self):
+        return len(self.store.scan('tokens'))
+
+    def _remove(self, path):
+        # Only ever delete inside the downloads directory
+        path = os.path.abspath(path)
+        if not path.startswith(self.downloads_dir + os.sep):
+            return
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+            # Remove the now empty job directories up to downloads/
+            parent = os.path.dirname(path)
+            while parent != self.downloads_dir and not os.listdir(parent):
+                shutil.rmtree(parent, ignore_errors=True)
+                parent = os.path.dirname(parent)
+        except OSError as e:
+            logger.error(f"Error removing expired download {path}: {e}")
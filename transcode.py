@@ -0,0 +1,137 @@
+import os
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Output formats: file extension, ffmpeg muxer and encoder, and the source
+# codecs that can be stream-copied into the container without re-encoding
+AUDIO_FORMATS = {
+    'mp3': {'ext': 'mp3', 'muxer': 'mp3', 'encoder': 'libmp3lame', 'codecs': ('mp3',)},
+    'm4a': {'ext': 'm4a', 'muxer': 'ipod', 'encoder': 'aac', 'codecs': ('mp4a', 'aac')},
+    'opus': {'ext': 'opus', 'muxer': 'ogg', 'encoder': 'libopus', 'codecs': ('opus',)},
+}
+
+# Keep the downloaded audio exactly as it is
+NATIVE = 'native'
+
+
+class TranscodeError(Exception):
+    """Raised when ffmpeg fails to convert a file."""
+
+
+class AudioTranscoder:
+    """
+    Converts downloaded audio outside the download path.
+
+    Every conversion is a separate ffmpeg process; at most `workers` of them
+    run at once (by default one per CPU core), so concurrent audio jobs queue
+    for a core instead of oversubscribing the machine. When the source codec
+    already matches the requested format the audio is stream-copied, and if
+    the file is already in the right container nothing runs at all.
+
+    Args:
+        workers (int): Maximum concurrent ffmpeg processes
+        quality (str): Target bitrate in kbit/s when re-encoding
+        ffmpeg (str): ffmpeg executable
+        threads (int): Threads each ffmpeg process may use
+    """
+
+    def __init__(self, workers=None, quality='192', ffmpeg='ffmpeg', threads=1):
+        self.workers = workers or os.cpu_count() or 1
+        self.quality = quality
+        self.ffmpeg = ffmpeg
+        self.threads = threads
+        self._pool = None
+        self._lock = threading.Lock()
+        self.encoded = 0
+        self.copied = 0
+        self.skipped = 0
+        self.failed = 0
+        self.pending = 0
+
+    def settings(self, audio_format):
+        """Returns the settings that determine the output, e.g. for cache keys."""
+        return {'key': 'AudioTranscoder', 'format': audio_format, 'quality': self.quality}
+
+    def convert(self, path, audio_format, source_codec=None, trace_id=None):
+        """
+        Converts path to audio_format and removes the source file.
+
+        Args:
+            path (str): Downloaded audio (or video) file
+            audio_format (str): 'mp3', 'm4a', 'opus' or 'native'
+            source_codec (str): Audio codec of path as reported by yt-dlp
+            trace_id (str): Request trace ID for stage timings
+
+        Returns:
+            str: Path of the converted file
+
+        Raises:
+            TranscodeError: If ffmpeg fails
+        """
+        if audio_format == NATIVE:
+            return path
+        spec = AUDIO_FORMATS[audio_format]
+        output = f"{os.path.splitext(path)[0]}.{spec['ext']}"
+        copy = bool(source_codec) and source_codec.split('.')[0] in spec['codecs']
+        if copy and output == path:
+            self.skipped += 1
+            return path
+
+        temp_output = output + '.part'
+        args = [self.ffmpeg, '-nostdin', '-y', '-loglevel', 'error', '-i', path, '-vn', '-map_metadata', '0']
+        if copy:
+            args += ['-c:a', 'copy']
+        else:
+            args += ['-c:a', spec['encoder'], '-b:a', f'{self.quality}k', '-threads', str(self.threads)]
+        args += ['-f', spec['muxer'], temp_output]
+
+        with self._lock:
+            self.pending += 1
+        try:
+            result = self._executor().submit(self._run, args, time.monotonic(), trace_id).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+        if result.returncode != 0:
+            self.failed += 1
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+            error = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+            raise TranscodeError(error[-1] if error else f'ffmpeg exited with {result.returncode}')
+
+        os.replace(temp_output, output)
+        if output != path:
+            os.remove(path)
+        if copy:
+            self.copied += 1
+        else:
+            self.encoded += 1
+        return output
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'encoded': self.encoded,
+            'copied': self.copied,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transcode')
+            return self._pool
+
+    def _run(self, args, submitted_at, trace_id):
+        observe_stage('transcode_queue_wait', time.monotonic() - submitted_at, trace_id)
+        return subprocess.run(args, capture_output=True)
@@ -1,56 +1,125 @@
-import os
 import logging
 import re
 import json
-import datetime
 from functools import wraps
 from urllib.parse import urlparse, parse_qs
-import yt_dlp
 
 logger = logging.getLogger(__name__)
 
-def is_valid_youtube_url(url):
+# Hosts that serve YouTube videos and playlists
+YOUTUBE_HOSTS = (
+    'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com',
+    'youtube-nocookie.com', 'www.youtube-nocookie.com',
+)
+SHORT_HOSTS = ('youtu.be', 'www.youtu.be')
+
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+PLAYLIST_ID_RE = re.compile(r'^[A-Za-z0-9_-]{2,}$')
+
+def canonicalize_url(url):
     """
-    Validates if a given URL is a valid YouTube URL.
+    Turns any supported YouTube URL form into a stable video or playlist ID.
+    
+    Accepts watch?v=, youtu.be/, /shorts/, /embed/, /v/, /live/ and
+    playlist?list= URLs, with or without scheme. A URL carrying a list=
+    parameter is treated as the playlist, as yt-dlp resolves it that way.
     
     Args:
-        url (str): The URL to validate
+        url (str): The URL to canonicalize
         
     Returns:
-        bool: True if it's a valid YouTube URL, False otherwise
+        dict: {'kind': 'video'|'playlist', 'id', 'key', 'url'} or None if
+        the URL is not a supported YouTube URL
     """
     if not url:
-        return False
+        return None
     
-    # Parse the URL
+    url = url.strip()
+    if '://' not in url:
+        url = 'https://' + url
     parsed_url = urlparse(url)
+    host = parsed_url.netloc.lower().split(':')[0]
+    query_params = parse_qs(parsed_url.query)
+    path_parts = [part for part in parsed_url.path.split('/') if part]
     
-    # Check if the domain is youtube.com or youtu.be
-    if parsed_url.netloc not in ('youtube.com', 'www.youtube.com', 'youtu.be', 'www.youtu.be'):
-        return False
+    kind = video_id = None
+    if host in YOUTUBE_HOSTS:
+        if query_params.get('list') and PLAYLIST_ID_RE.match(query_params['list'][0]):
+            kind, video_id = 'playlist', query_params['list'][0]
+        elif query_params.get('v'):
+            kind, video_id = 'video', query_params['v'][0]
+        elif len(path_parts) >= 2 and path_parts[0] in ('shorts', 'embed', 'v', 'live'):
+            kind, video_id = 'video', path_parts[1]
+    elif host in SHORT_HOSTS and path_parts:
+        if query_params.get('list') and PLAYLIST_ID_RE.match(query_params['list'][0]):
+            kind, video_id = 'playlist', query_params['list'][0]
+        else:
+            kind, video_id = 'video', path_parts[0]
     
-    # Check if it's a video URL
-    if parsed_url.netloc in ('youtube.com', 'www.youtube.com'):
-        query_params = parse_qs(parsed_url.query)
-        
-        # Check for video ID in query parameters
-        if 'v' in query_params:
-            return True
+    if kind == 'video' and not VIDEO_ID_RE.match(video_id or ''):
+        return None
+    if not kind:
+        return None
+    
+    if kind == 'playlist':
+        canonical_url = f'https://www.youtube.com/playlist?list={video_id}'
+    else:
+        canonical_url = f'https://www.youtube.com/watch?v={video_id}'
+    
+    return {
+        'kind': kind,
+        'id': video_id,
+        'key': f'{kind}:{video_id}',
+        'url': canonical_url,
+    }
+
+def is_valid_youtube_url(url):
+    """
+    Validates if a given URL is a valid YouTube URL.
+    
+    Args:
+        url (str): The URL to validate
         
-        # Check for playlist
-        if 'list' in query_params:
-            return True
+    Returns:
+        bool: True if it's a valid YouTube URL, False otherwise
+    """
+    return canonicalize_url(url) is not None
+
+def get_canonical_id(url):
+    """
+    Reduces a YouTube URL to a stable identifier for caching.
+    
+    Args:
+        url (str): A YouTube video or playlist URL
         
-        # Check for shorts
-        if '/shorts/' in parsed_url.path:
-            return True
+    Returns:
+        str: 'playlist:<id>' or 'video:<id>', or None if no ID was found
+    """
+    canonical = canonicalize_url(url)
+    return canonical['key'] if canonical else None
+
+def estimate_filesize(format_info, duration=None):
+    """
+    Estimates the size of a format in bytes.
     
-    # Check for youtu.be short URLs
-    elif parsed_url.netloc in ('youtu.be', 'www.youtu.be'):
-        if parsed_url.path and parsed_url.path != '/':
-            return True
+    Uses the exact filesize if yt-dlp knows it, then its approximation,
+    then the average bitrate times the duration.
     
-    return False
+    Args:
+        format_info (dict): One entry of the yt-dlp formats list
+        duration (float): Video duration in seconds
+        
+    Returns:
+        int: Estimated size in bytes, or None if it cannot be estimated
+    """
+    size = format_info.get('filesize') or format_info.get('filesize_approx')
+    if size:
+        return int(size)
+    tbr = format_info.get('tbr')
+    if tbr and duration:
+        # tbr is given in kbit/s
+        return int(tbr * 1000 / 8 * duration)
+    return None
 
 def get_available_formats(video_info):
     """
@@ -60,34 +129,58 @@ def get_available_formats(video_info):
         video_info (dict): The video info dictionary from yt-dlp
         
     Returns:
-        dict: A dictionary containing video and audio formats
+        dict: A dictionary containing progressive video formats ('video'),
+            video-only streams that need an audio merge ('video_only') and
+            audio formats ('audio')
     """
     video_formats = []
+    video_only_formats = []
     audio_formats = []
+    duration = video_info.get('duration')
     
     for format_info in video_info.get('formats', []):
         # Skip formats without resolution or with unknown resolution
-        format_note = format_info.get('format_note', '')
+        format_note = format_info.get('format_note', '') or ''
+        vcodec = format_info.get('vcodec') or 'none'
+        acodec = format_info.get('acodec') or 'none'
+        height = format_info.get('height')
+        if not format_note and height:
+            format_note = f"{height}p"
         
-        if format_info.get('vcodec', 'none') != 'none' and format_info.get('acodec', 'none') != 'none':
+        if vcodec != 'none' and acodec != 'none':
             # This is a video with audio
             if format_note and 'p' in format_note:  # Only add if it has proper resolution
                 video_formats.append({
                     'format_id': format_info.get('format_id', ''),
                     'ext': format_info.get('ext', ''),
                     'resolution': format_note,
-                    'filesize': format_info.get('filesize', 0),
-                    'vcodec': format_info.get('vcodec', ''),
-                    'acodec': format_info.get('acodec', '')
+                    'height': height,
+                    'fps': format_info.get('fps'),
+                    'filesize': estimate_filesize(format_info, duration) or 0,
+                    'vcodec': vcodec,
+                    'acodec': acodec
+                })
+        elif vcodec != 'none' and format_info.get('acodec') == 'none':
+            # This is video only; needs to be merged with an audio stream
+            if height:
+                video_only_formats.append({
+                    'format_id': format_info.get('format_id', ''),
+                    'ext': format_info.get('ext', ''),
+                    'resolution': format_note,
+                    'height': height,
+                    'fps': format_info.get('fps'),
+                    'filesize': estimate_filesize(format_info, duration) or 0,
+                    'vcodec': vcodec
                 })
-        elif format_info.get('vcodec', '') == 'none' and format_info.get('acodec', 'none') != 'none':
+        elif format_info.get('vcodec') == 'none' and acodec != 'none':
             # This is audio only
             audio_formats.append({
                 'format_id': format_info.get('format_id', ''),
                 'ext': format_info.get('ext', ''),
                 'audio_quality': format_note,
-                'filesize': format_info.get('filesize', 0),
-                'acodec': format_info.get('acodec', '')
+                'abr': format_info.get('abr'),
+                'filesize': estimate_filesize(format_info, duration) or 0,
+                'acodec': acodec
             })
     
     # Remove duplicates based on resolution
@@ -100,19 +193,27 @@ def get_available_formats(video_info):
     # Sort video formats by resolution (high to low)
     sorted_video_formats = sorted(
         unique_video_formats.values(),
-        key=lambda x: int(x['resolution'].replace('p', '')) if x['resolution'].replace('p', '').isdigit() else 0,
+        key=lambda x: x['height'] or (int(x['resolution'].replace('p', '')) if x['resolution'].replace('p', '').isdigit() else 0),
+        reverse=True
+    )
+    
+    # Sort video-only streams by resolution, then frame rate (high to low)
+    sorted_video_only_formats = sorted(
+        video_only_formats,
+        key=lambda x: (x['height'], x['fps'] or 0),
         reverse=True
     )
     
-    # Sort audio formats by quality (assuming higher format_id is better quality in this case)
+    # Sort audio formats by bitrate, falling back to the format ID
     sorted_audio_formats = sorted(
         audio_formats,
-        key=lambda x: int(x['format_id']) if x['format_id'].isdigit() else 0,
+        key=lambda x: (x['abr'] or 0, int(x['format_id']) if x['format_id'].isdigit() else 0),
         reverse=True
     )
     
     return {
         'video': sorted_video_formats,
+        'video_only': sorted_video_only_formats,
         'audio': sorted_audio_formats
     }
 
@@ -163,25 +264,3 @@ def format_filesize(bytes_size):
         return f"{gb_size:.2f} GB"
     else:
         return f"{mb_size:.1f} MB"
-
-def log_download(log_file, video_title, ip_address, user_agent):
-    """
-    Logs download information to a file.
-    
-    Args:
-        log_file (str): Path to the log file
-        video_title (str): Title of the downloaded video
-        ip_address (str): IP address of the client
-        user_agent (str): User agent string of the client
-    """
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Create directory if it doesn't exist
-    log_dir = os.path.dirname(log_file)
-    if log_dir and not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
-    # Log the download
-    with open(log_file, 'a', encoding='utf-8') as f:
-        log_entry = f"[{timestamp}] Video: {video_title} | IP: {ip_address} | Agent: {user_agent}\n"
-        f.write(log_entry)